@@ -0,0 +1,82 @@
+# admission.py
+import threading
+import time
+
+from cache import TTLCache
+from common.log import logger
+
+ADMIT = "admit"
+DEGRADE = "degrade"
+REJECT = "reject"
+
+
+# 准入控制：正在进行的上游请求数或执行池排队时间超过阈值时视为过载
+# 过载时可缓存的指令返回最近一次的结果（DEGRADE），耗费较大的指令直接回复繁忙（REJECT），其余指令照常执行
+class AdmissionController:
+    def __init__(self, in_flight, queue_wait=None, max_inflight=20, max_queue_wait=3.0,
+                 cacheable=(), expensive=(), max_age=86400, maxsize=512):
+        self.in_flight = in_flight
+        self.queue_wait = queue_wait
+        self.max_inflight = max_inflight
+        self.max_queue_wait = max_queue_wait
+        self.cacheable = set(cacheable)
+        self.expensive = set(expensive)
+        # 按消息内容保存最近一次成功的回复：(回复类型, 内容, 时间)
+        self._last_known = TTLCache(maxsize=maxsize, default_ttl=max_age)
+        self._lock = threading.Lock()
+        self.decisions = {ADMIT: 0, DEGRADE: 0, REJECT: 0}
+        self.overloads = {}
+
+    @classmethod
+    def from_config(cls, conf, in_flight, queue_wait=None):
+        conf = conf or {}
+        return cls(in_flight, queue_wait,
+                   max_inflight=int(conf.get("max_inflight", 20)),
+                   max_queue_wait=float(conf.get("max_queue_wait", 3.0)),
+                   cacheable=conf.get(
+                       "cacheable", ["早报", "摸鱼", "八卦", "摸鱼视频", "每日一题", "热榜", "星座", "天气"]),
+                   expensive=conf.get("expensive", ["搜索音乐"]),
+                   max_age=float(conf.get("max_age", 86400)),
+                   maxsize=int(conf.get("maxsize", 512)))
+
+    # 过载时返回原因，否则返回 None
+    def overload_reason(self):
+        if self.in_flight() >= self.max_inflight:
+            return "in_flight"
+        queue_wait = self.queue_wait() if self.queue_wait else None
+        if queue_wait is not None and queue_wait >= self.max_queue_wait:
+            return "queue_wait"
+        return None
+
+    def check(self, command):
+        decision = ADMIT
+        reason = None
+        if command in self.cacheable or command in self.expensive:
+            reason = self.overload_reason()
+            if reason is not None:
+                decision = REJECT if command in self.expensive else DEGRADE
+        with self._lock:
+            self.decisions[decision] += 1
+            if reason is not None:
+                self.overloads[reason] = self.overloads.get(reason, 0) + 1
+        if decision != ADMIT:
+            logger.warn(
+                f"[whalePlugin] overloaded ({reason}), {decision} {command}")
+        return decision
+
+    def remember(self, key, reply_type, content):
+        self._last_known.set(key, (reply_type, content, time.time()))
+
+    # 返回 (回复类型, 内容, 数据年龄秒数)，没有记录时返回 None
+    def last_known(self, key):
+        entry = self._last_known.get(key)
+        if entry is None:
+            return None
+        reply_type, content, stored_at = entry
+        return reply_type, content, time.time() - stored_at
+
+    def stats(self):
+        queue_wait = self.queue_wait() if self.queue_wait else None
+        with self._lock:
+            return {"in_flight": self.in_flight(), "queue_wait": queue_wait,
+                    "decisions": dict(self.decisions), "overloads": dict(self.overloads)}
@@ -0,0 +1,235 @@
+# run_bench.py
+# 压测脚本：启动本地上游模拟服务，用混合消息负载驱动插件的 on_handle_context，
+# 输出吞吐、延迟分位数以及各上游接口的实际调用次数
+#
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python plugins/whalePlugin/bench/run_bench.py --requests 2000 --concurrency 16
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from stub_server import StubServer  # noqa: E402
+
+# (消息, 权重)：大部分消息是不触发插件的闲聊，其余按常见使用频率分布
+WORKLOAD = [
+    ("今天吃什么", 30),
+    ("哈哈哈", 20),
+    ("早报", 10),
+    ("摸鱼", 6),
+    ("每日一题", 3),
+    ("八卦", 3),
+    ("摸鱼视频", 2),
+    ("白羊座", 3),
+    ("狮子座", 3),
+    ("双鱼座", 2),
+    ("微博热榜", 5),
+    ("知乎热榜", 3),
+    ("虎扑热榜", 2),
+    ("北京天气", 4),
+    ("上海明天天气", 2),
+    ("杭州七天天气", 1),
+    ("搜索音乐 晴天", 1),
+]
+
+
+def bench_config(stub, args):
+    return {
+        "alapi_token": "bench-token",
+        "morning_news_text_enabled": True,
+        "http": {
+            "base_overrides": stub.base_overrides(),
+            "pool_maxsize": max(10, args.concurrency),
+            "max_retries": 0,
+        },
+        "executor": {
+            "enabled": args.mode == "async",
+            "max_workers": args.concurrency,
+            "max_queue": args.requests,
+        },
+        "music_search": {"max_workers": 5, "timeout": 6.0},
+    }
+
+
+def load_plugin(conf, stub):
+    from plugins import Plugin, PluginManager
+    from http_client import http_client
+
+    # 与插件管理器加载插件时一致：注册前需要设置插件目录
+    PluginManager().current_plugin_path = PLUGIN_DIR
+    import importlib
+    module = importlib.import_module(
+        f"plugins.{os.path.basename(PLUGIN_DIR)}.whalePlugin")
+    # 插件通过 super().load_config() 读取配置，需替换基类的方法，
+    # 否则会读到真实的 config.json，用真实 token 请求线上接口
+    original = Plugin.load_config
+    Plugin.load_config = lambda self: conf
+    try:
+        plugin = module.whalePlugin()
+    finally:
+        Plugin.load_config = original
+    if http_client.base_overrides != stub.base_overrides():
+        raise SystemExit("bench config was not applied, refusing to hit live upstreams")
+    return plugin
+
+
+class BenchChannel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = []
+
+    def send(self, reply, context):
+        with self.lock:
+            self.sent.append((context, reply, time.perf_counter()))
+        context["bench_done"].set()
+
+
+def make_context(content, index, groups):
+    from bridge.context import Context, ContextType
+
+    user = f"user-{index % 50}"
+    if groups and index % 2:
+        msg = SimpleNamespace(actual_user_id=user,
+                              other_user_id=f"group-{index % groups}")
+        kwargs = {"isgroup": True, "msg": msg, "receiver": msg.other_user_id}
+    else:
+        kwargs = {"isgroup": False, "receiver": user}
+    kwargs["bench_done"] = threading.Event()
+    return Context(ContextType.TEXT, content, kwargs=kwargs)
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p * (len(samples) - 1))))]
+
+
+def run(plugin, args):
+    from plugins import Event, EventContext
+    from bridge.reply import Reply
+
+    rng = random.Random(args.seed)
+    messages, weights = zip(*WORKLOAD)
+    workload = rng.choices(messages, weights=weights, k=args.requests)
+    channel = BenchChannel()
+    latencies = []
+    handled = Counter()
+    lock = threading.Lock()
+    cursor = iter(enumerate(workload))
+
+    def worker():
+        while True:
+            with lock:
+                item = next(cursor, None)
+            if item is None:
+                return
+            index, content = item
+            context = make_context(content, index, args.groups)
+            e_context = EventContext(Event.ON_HANDLE_CONTEXT, {
+                "channel": channel, "context": context, "reply": Reply()})
+            start = time.perf_counter()
+            plugin.on_handle_context(e_context)
+            if not e_context.is_pass():
+                elapsed = time.perf_counter() - start
+                status = "ignored"
+            elif e_context["reply"].type is not None:
+                elapsed = time.perf_counter() - start
+                status = "inline"
+            else:
+                # 异步模式：回复通过 channel.send 发出
+                context["bench_done"].wait(args.timeout)
+                elapsed = time.perf_counter() - start
+                status = "async" if context["bench_done"].is_set() else "timeout"
+            with lock:
+                handled[status] += 1
+                if status != "ignored":
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, handled
+
+
+def report(title, duration, latencies, handled, stub):
+    total = sum(handled.values())
+    print(f"== {title} ==")
+    print(f"messages: {total}  duration: {duration:.2f}s  "
+          f"throughput: {total / duration if duration else 0:.1f} msg/s")
+    print("outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(handled.items())))
+    print(f"command latency: p50={percentile(latencies, 0.5) * 1000:.1f}ms  "
+          f"p95={percentile(latencies, 0.95) * 1000:.1f}ms  "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f}ms  "
+          f"max={max(latencies, default=0) * 1000:.1f}ms")
+    print(f"upstream calls: {sum(stub.calls.values())}  "
+          f"injected errors: {sum(stub.errors.values())}")
+    for route, count in sorted(stub.calls.items()):
+        print(f"  {route:40s} {count:6d}")
+
+
+def parse_upstream_latency(values):
+    result = {}
+    for value in values or []:
+        name, seconds = value.split("=", 1)
+        result[name] = float(seconds)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="whalePlugin benchmark")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=("inline", "async"), default="inline",
+                        help="inline 在调用线程中执行指令，async 开启 executor")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="上游基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02,
+                        help="上游延迟随机抖动上限（秒）")
+    parser.add_argument("--upstream-latency", action="append", metavar="NAME=SECONDS",
+                        help="按上游覆盖延迟，例如 alapi=0.3，可重复")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="上游注入 500 错误的比例")
+    parser.add_argument("--groups", type=int, default=5,
+                        help="模拟的群数量，0 表示全部为私聊")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="异步模式下等待单条回复的超时（秒）")
+    parser.add_argument("--rounds", type=int, default=2,
+                        help="运行轮数，第一轮为冷缓存，之后为热缓存")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    stub = StubServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      upstream_latency=parse_upstream_latency(args.upstream_latency),
+                      seed=args.seed).start()
+    try:
+        plugin = load_plugin(bench_config(stub, args), stub)
+        for round_index in range(args.rounds):
+            stub.reset()
+            duration, latencies, handled = run(plugin, args)
+            # 冷缓存时指令必然会请求上游，模拟服务没有收到请求说明请求发往了别处
+            if round_index == 0 and latencies and not sum(stub.calls.values()):
+                raise SystemExit("stub server received no requests, check http.base_overrides")
+            title = "cold cache" if round_index == 0 else f"warm cache #{round_index}"
+            report(title, duration, latencies, handled, stub)
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# stub_server.py
+# 本地上游模拟服务：返回 fixtures.json 中录制的数据，支持延迟和错误注入，并统计每个接口的调用次数
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures.json")
+CITIES_PATH = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "duplicate-citys.json")
+
+# 各上游在 stub 中的路径前缀，对应 http.base_overrides
+UPSTREAMS = {
+    "https://api.vvhan.com": "vvhan",
+    "https://v2.alapi.cn": "alapi",
+    "https://dayu.qqsuu.cn": "qqsuu",
+    "https://leetcode.com": "leetcode",
+}
+
+
+def _render(value, variables):
+    if isinstance(value, dict):
+        return {k: _render(v, variables) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_render(v, variables) for v in value]
+    if isinstance(value, str) and "{" in value:
+        for key, replacement in variables.items():
+            value = value.replace("{" + key + "}", str(replacement))
+    return value
+
+
+class StubServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, jitter=0.02, error_rate=0.0,
+                 upstream_latency=None, seed=None, fixtures_path=FIXTURES_PATH):
+        with open(fixtures_path, "r", encoding="utf-8") as f:
+            self.fixtures = json.load(f)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.upstream_latency = dict(upstream_latency or {})
+        # city_id -> 城市名：按 ID 查询时返回与按城市名查询时相同的名字，插件记住的 ID 才能通过校验
+        self.city_names = self._load_city_names()
+        self.calls = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="whale-stub", daemon=True)
+
+    @staticmethod
+    def _load_city_names():
+        try:
+            with open(CITIES_PATH, "r", encoding="utf-8") as f:
+                conditions = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {str(entry["city_id"]): name for name, info in conditions.items()
+                for entry in info.get("data", [])}
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # 供插件 http.base_overrides 使用
+    def base_overrides(self):
+        return {origin: f"{self.base_url}/{prefix}" for origin, prefix in UPSTREAMS.items()}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def _delay(self, upstream):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+        time.sleep(self.upstream_latency.get(upstream, self.latency) + jitter)
+        return failed
+
+    def _payload(self, path, params):
+        if path.startswith("/vvhan/api/hotlist/"):
+            return self.fixtures["/vvhan/api/hotlist"]
+        fixture = self.fixtures.get(path)
+        if fixture is None:
+            return None
+        now = datetime.now().replace(minute=0, second=0, microsecond=0)
+        city = params.get("city", "")
+        city_id = params.get("city_id")
+        if city_id:
+            with self._lock:
+                city = self.city_names.get(city_id, city or f"城市{city_id}")
+        elif city:
+            city_id = f"101{zlib.crc32(city.encode('utf-8')) % 1000000:06d}"
+            with self._lock:
+                city_id = next((known_id for known_id, name in self.city_names.items()
+                                if name == city), city_id)
+                self.city_names.setdefault(city_id, city)
+        variables = {
+            "city": city,
+            "city_id": city_id,
+            "id": params.get("id", ""),
+            "update_time": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "hour_1": (now + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S"),
+            "hour_2": (now + timedelta(hours=2)).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        return _render(fixture, variables)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _params(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length).decode("utf-8")
+                    if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                        params.update({k: v[0]
+                                      for k, v in parse_qs(body).items()})
+                return parsed.path, params
+
+            def _send(self, status, body=b"", content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _handle(self):
+                path, params = self._params()
+                upstream = path.strip("/").split("/", 1)[0]
+                route = path
+                for prefix in ("/vvhan/api/hotlist/", "/qqsuu/media/"):
+                    if path.startswith(prefix):
+                        route = prefix + "*"
+                with stub._lock:
+                    stub.calls[route] += 1
+                if stub._delay(upstream):
+                    with stub._lock:
+                        stub.errors[route] += 1
+                    self._send(500, b'{"code":500,"msg":"injected error"}')
+                    return
+                if "/media/" in path:
+                    self._send(200, b"stub-media", "application/octet-stream")
+                    return
+                payload = stub._payload(path, params)
+                if payload is None:
+                    self._send(404, b'{"code":404}')
+                    return
+                self._send(200, json.dumps(
+                    payload, ensure_ascii=False).encode("utf-8"))
+
+            do_GET = _handle
+            do_POST = _handle
+            do_HEAD = _handle
+
+            def log_message(self, format, *args):
+                return
+
+        return Handler
@@ -0,0 +1,144 @@
+# breaker.py
+import threading
+import time
+from collections import deque
+
+import requests
+from providers import LatencyTracker
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+# 单个上游主机的熔断器
+# 最近 window 次请求的失败率（超时、5xx 或慢请求都算失败）超过 error_rate，或连续失败 failure_threshold 次时打开；
+# 打开 open_duration 秒后进入半开状态，放行少量探测请求，连续成功 success_threshold 次后关闭
+class CircuitBreaker:
+    def __init__(self, host, failure_threshold=5, error_rate=0.5, window=20, min_calls=10,
+                 slow_call_threshold=5.0, open_duration=30.0, half_open_max_calls=1,
+                 success_threshold=2, timeout_percentile=0.99, timeout_multiplier=2.0,
+                 min_timeout=1.0, min_samples=20):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.slow_call_threshold = slow_call_threshold
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self.state = CLOSED
+        self.opened_at = None
+        self.trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._latency = LatencyTracker(window=200)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.open_duration:
+                    return False
+                self.state = HALF_OPEN
+                self._half_open_calls = 0
+                self._half_open_successes = 0
+            if self.state == HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    return False
+                self._half_open_calls += 1
+            return True
+
+    # 请求被放行但没有结果（例如调用方自己的截止时间到了），归还半开状态下的探测名额
+    def release(self):
+        with self._lock:
+            if self.state == HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        self._outcomes.clear()
+        self._consecutive_failures = 0
+
+    def record_success(self, latency):
+        self._latency.record(latency)
+        if latency > self.slow_call_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            self._outcomes.append(True)
+            self._consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                self._half_open_calls -= 1
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.success_threshold:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            self._consecutive_failures += 1
+            failures = self._outcomes.count(False)
+            if self._consecutive_failures >= self.failure_threshold or (
+                    len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate):
+                self._open()
+
+    # 根据观测到的延迟分位数收紧读取超时，但不超过配置的上限
+    def adaptive_timeout(self, timeout):
+        connect, read = timeout
+        if len(self._latency) < self.min_samples:
+            return timeout
+        observed = self._latency.percentile(
+            self.timeout_percentile) * self.timeout_multiplier
+        return (connect, min(read, max(self.min_timeout, observed)))
+
+    def stats(self):
+        with self._lock:
+            failures = self._outcomes.count(False)
+            calls = len(self._outcomes)
+            state = self.state
+        return {"state": state, "trips": self.trips,
+                "error_rate": failures / calls if calls else 0.0,
+                "p50": self._latency.percentile(0.5),
+                "p99": self._latency.percentile(0.99)}
+
+
+class BreakerRegistry:
+    def __init__(self, options=None):
+        self.options = dict(options or {})
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, options):
+        with self._lock:
+            self.options = dict(options or {})
+            self._breakers = {}
+
+    def get(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(host, **self.options)
+                self._breakers[host] = breaker
+            return breaker
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.host: breaker.stats() for breaker in breakers}
@@ -0,0 +1,340 @@
+# cache.py
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from common.log import logger
+
+_MISSING = object()
+
+
+def _store_key(key):
+    return json.dumps(key, default=str, ensure_ascii=False)
+
+
+# 带过期时间的 LRU 缓存，超过 maxsize 时淘汰最久未使用的条目
+# 指定 store（persistent_cache.CacheNamespace）时写穿到持久化缓存，内存未命中时从持久化缓存读取
+class TTLCache:
+    def __init__(self, maxsize=128, default_ttl=300, store=None):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.store = store
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_hits = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.evictions += 1
+        if self.store is not None:
+            stored = self.store.get(_store_key(key))
+            if stored is not None:
+                value, _, expires_at = stored
+                self._set_local(key, value, expires_at)
+                with self._lock:
+                    self.hits += 1
+                    self.store_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _set_local(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        if expires_at is None:
+            ttl = self.default_ttl if ttl is None else ttl
+            expires_at = time.time() + ttl if ttl is not None else None
+        self._set_local(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(_store_key(key), value, expires_at)
+
+    def evict(self, key):
+        if self.store is not None:
+            self.store.delete(_store_key(key))
+        with self._lock:
+            if self._data.pop(key, _MISSING) is _MISSING:
+                return False
+            self.evictions += 1
+            return True
+
+    def clear(self):
+        if self.store is not None:
+            self.store.delete()
+        with self._lock:
+            self.evictions += len(self._data)
+            self._data.clear()
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (exp, _) in self._data.items()
+                       if exp is not None and exp <= now]
+            for key in expired:
+                del self._data[key]
+            self.evictions += len(expired)
+        return len(expired)
+
+    def get_or_load(self, key, loader, ttl=None, expires_at=None, should_cache=None):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        if should_cache is None or should_cache(value):
+            self.set(key, value, ttl=ttl, expires_at=expires_at)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "store_hits": self.store_hits}
+
+
+def _parse_cutover(value):
+    hour, minute = str(value).split(":")
+    return int(hour), int(minute)
+
+
+# 按“内容日”缓存每日更新的内容（早报、摸鱼、八卦、每日一题）
+# 每个条目在下一个切换时间点失效，切换时间之前仍视为前一天的内容
+class DailyCache:
+    def __init__(self, cutover="06:00", cutovers=None, maxsize=64, store=None):
+        self.cutover = _parse_cutover(cutover)
+        self.cutovers = {name: _parse_cutover(value)
+                         for name, value in (cutovers or {}).items()}
+        self._cache = TTLCache(maxsize=maxsize, default_ttl=None, store=store)
+
+    @classmethod
+    def from_config(cls, conf, store=None):
+        conf = conf or {}
+        return cls(cutover=conf.get("cutover", "06:00"),
+                   cutovers=conf.get("cutovers"),
+                   maxsize=int(conf.get("maxsize", 64)),
+                   store=store)
+
+    def _cutover_for(self, name):
+        return self.cutovers.get(name, self.cutover)
+
+    def content_day(self, name, now=None):
+        now = now or datetime.now()
+        hour, minute = self._cutover_for(name)
+        if (now.hour, now.minute) < (hour, minute):
+            return now.date() - timedelta(days=1)
+        return now.date()
+
+    def next_cutover(self, name, now=None):
+        now = now or datetime.now()
+        hour, minute = self._cutover_for(name)
+        day = self.content_day(name, now) + timedelta(days=1)
+        return datetime(day.year, day.month, day.day, hour, minute)
+
+    def get(self, name, default=None, now=None):
+        return self._cache.get((name, self.content_day(name, now)), default)
+
+    def set(self, name, value, now=None):
+        key = (name, self.content_day(name, now))
+        self._cache.set(key, value,
+                        expires_at=self.next_cutover(name, now).timestamp())
+
+    def get_or_load(self, name, loader, should_cache=None):
+        now = datetime.now()
+        value = self.get(name, _MISSING, now)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        if should_cache is None or should_cache(value):
+            self.set(name, value, now)
+            logger.debug(f"[whalePlugin] daily cache stored {name}")
+        return value
+
+    def evict(self, name=None):
+        # 不指定名称时清空全部缓存
+        if name is None:
+            self._cache.clear()
+            return True
+        return self._cache.evict((name, self.content_day(name)))
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# 过期后先返回旧数据，同时在后台刷新（stale-while-revalidate）
+# 每个 key 可以单独设置刷新间隔；超过 max_stale 的数据改为同步刷新，刷新失败时仍返回旧数据
+# 指定 store 时数据同时写入持久化缓存，其它进程刷新过的数据直接采用，不再重复请求上游
+class StaleWhileRevalidateCache:
+    def __init__(self, loader, refresh_interval=300, intervals=None, max_stale=3600,
+                 should_cache=None, max_workers=2, store=None):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.intervals = dict(intervals or {})
+        self.max_stale = max_stale
+        self.should_cache = should_cache
+        self.store = store
+        self._data = {}  # key -> (fetched_at, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whale-swr")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def interval_for(self, key):
+        return self.intervals.get(key, self.refresh_interval)
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None:
+            entry = self._load_stored(key)
+        return entry
+
+    # 持久化缓存中的数据比内存中新时采用它，返回 (fetched_at, value)
+    def _load_stored(self, key):
+        stored = self.store.get(str(key)) if self.store is not None else None
+        if stored is None:
+            return None
+        value, fetched_at, _ = stored
+        with self._lock:
+            current = self._data.get(key)
+            if current is None or current[0] < fetched_at:
+                self._data[key] = (fetched_at, value)
+                current = (fetched_at, value)
+            return current
+
+    def _put(self, key, value):
+        fetched_at = time.time()
+        with self._lock:
+            self._data[key] = (fetched_at, value)
+        if self.store is not None:
+            self.store.set(str(key), value, fetched_at +
+                           self.max_stale, fetched_at)
+
+    # 同步刷新，成功返回 True
+    def refresh(self, key):
+        stored = self._load_stored(key)
+        if stored is not None and time.time() - stored[0] < self.interval_for(key):
+            return True
+        value = self.loader(key)
+        if self.should_cache is not None and not self.should_cache(value):
+            return False
+        self._put(key, value)
+        return True
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(key)
+            except Exception as e:
+                logger.error(f"[whalePlugin] background refresh {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._pool.submit(run)
+
+    # 返回 (数据, 数据年龄秒数)
+    def get(self, key):
+        entry = self.peek(key)
+        now = time.time()
+        if entry is not None:
+            fetched_at, value = entry
+            age = now - fetched_at
+            if age < self.interval_for(key):
+                self.hits += 1
+                return value, age
+            if age < self.max_stale:
+                self.stale_hits += 1
+                self._refresh_in_background(key)
+                return value, age
+
+        self.misses += 1
+        value = self.loader(key)
+        if self.should_cache is None or self.should_cache(value):
+            self._put(key, value)
+            return value, 0
+        if entry is not None:
+            # 刷新失败时返回旧数据
+            fetched_at, stale_value = entry
+            return stale_value, now - fetched_at
+        return value, None
+
+    def evict(self, key=None):
+        if self.store is not None:
+            self.store.delete(None if key is None else str(key))
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits,
+                    "stale_hits": self.stale_hits, "misses": self.misses}
+
+
+# 负缓存：记录已知为空（如周末没有摸鱼日历）或失败的结果，按原因设置过期时间
+# 过期前的重复请求直接返回记录的提示，不再请求同一个出问题的接口
+class NegativeCache:
+    DEFAULT_TTLS = {"error": 30, "no_content": 3600}
+
+    def __init__(self, ttls=None, maxsize=256):
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self._cache = TTLCache(maxsize=maxsize, default_ttl=None)
+
+    @classmethod
+    def from_config(cls, conf):
+        conf = conf or {}
+        return cls(ttls={reason: float(ttl) for reason, ttl in (conf.get("ttls") or {}).items()},
+                   maxsize=int(conf.get("maxsize", 256)))
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        return entry[1] if entry is not None else None
+
+    # expires_at 优先于按原因配置的过期时间，例如“今日无内容”记录到下一个内容日
+    def set(self, key, reason, value, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttls.get(reason, self.ttls["error"])
+        self._cache.set(key, (reason, value), expires_at=expires_at)
+        logger.debug(f"[whalePlugin] negative cache {key}: {reason}")
+
+    def evict(self, key):
+        return self._cache.evict(key)
+
+    def stats(self):
+        return self._cache.stats()
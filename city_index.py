@@ -0,0 +1,127 @@
+# city_index.py
+import bisect
+import difflib
+import threading
+from collections import OrderedDict
+
+CITY_SUFFIXES = ("市", "县", "区", "镇")
+
+
+# 生成城市名的别名：带/不带 市/县/区/镇 后缀
+def city_aliases(name):
+    name = name.strip()
+    aliases = [name]
+    if len(name) > 2 and name[-1] in CITY_SUFFIXES:
+        aliases.append(name[:-1])
+    return aliases
+
+
+class CityMatch:
+    def __init__(self, name, entries):
+        self.name = name
+        self.entries = entries
+
+    @property
+    def ambiguous(self):
+        return len(self.entries) > 1
+
+    @property
+    def city_id(self):
+        return self.entries[0]["city_id"] if len(self.entries) == 1 else None
+
+
+# 城市索引：启动时从 duplicate-citys.json 加载一次，城市名/别名/city_id 都映射到规范 ID
+# 通过接口查询成功的城市名会被记录下来，之后直接按 ID 查询；确认无效的城市名也会记录，避免重复请求
+class CityIndex:
+    def __init__(self, max_rejected=1024):
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._by_id = {}
+        self._names = []
+        self._rejected = OrderedDict()
+        self.max_rejected = max_rejected
+
+    @classmethod
+    def from_conditions(cls, conditions):
+        index = cls()
+        for name, info in (conditions or {}).items():
+            for entry in info.get("data", []):
+                index.add(name, entry["city_id"], entry.get(
+                    "province", ""), entry.get("leader", ""))
+        return index
+
+    def add(self, name, city_id, province="", leader=""):
+        city_id = str(city_id)
+        with self._lock:
+            entry = self._by_id.get(city_id)
+            if entry is None:
+                entry = {"name": name, "city_id": city_id,
+                         "province": province, "leader": leader}
+                self._by_id[city_id] = entry
+            for alias in city_aliases(name):
+                entries = self._by_name.setdefault(alias, [])
+                if entry not in entries:
+                    entries.append(entry)
+                if len(entries) == 1:
+                    bisect.insort(self._names, alias)
+                self._rejected.pop(alias, None)
+        return entry
+
+    # 记录接口返回的城市名与 ID
+    def learn(self, name, city_id, province=""):
+        if not name or not city_id:
+            return
+        with self._lock:
+            entries = self._by_name.get(name.strip())
+            if entries and any(e["city_id"] == str(city_id) for e in entries):
+                return
+        self.add(name, city_id, province)
+
+    def reject(self, name):
+        with self._lock:
+            self._rejected[name] = True
+            self._rejected.move_to_end(name)
+            while len(self._rejected) > self.max_rejected:
+                self._rejected.popitem(last=False)
+
+    def is_rejected(self, name):
+        with self._lock:
+            return name in self._rejected
+
+    def by_id(self, city_id):
+        with self._lock:
+            return self._by_id.get(str(city_id))
+
+    def resolve(self, query):
+        query = query.strip()
+        if query.isnumeric():
+            entry = self.by_id(query)
+            return CityMatch(query, [entry]) if entry else None
+        with self._lock:
+            for alias in city_aliases(query):
+                entries = self._by_name.get(alias)
+                if entries:
+                    return CityMatch(alias, list(entries))
+        return None
+
+    # 前缀匹配
+    def search(self, prefix, limit=5):
+        with self._lock:
+            start = bisect.bisect_left(self._names, prefix)
+            result = []
+            for name in self._names[start:]:
+                if not name.startswith(prefix) or len(result) >= limit:
+                    break
+                result.append(name)
+            return result
+
+    # 模糊匹配，用于输错城市名时给出建议
+    def suggest(self, query, limit=3, cutoff=0.5):
+        candidates = self.search(query[:1], limit=50) if query else []
+        with self._lock:
+            names = candidates or list(self._names)
+        return difflib.get_close_matches(query, names, n=limit, cutoff=cutoff)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
@@ -0,0 +1,74 @@
+# deadline.py
+import contextvars
+import time
+from contextlib import contextmanager
+
+import requests
+
+
+class DeadlineExceededError(requests.RequestException):
+    pass
+
+
+# 一条指令的总耗时预算：所有上游请求、链接检查和备用数据源共享同一个截止时间
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        # 有请求因预算用完被拒绝或被截断时置为 True，回复中提示结果可能不完整
+        self.exceeded = False
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    # 把 (连接超时, 读取超时) 限制在剩余预算内，返回 (timeout, 是否被截断)
+    def clamp(self, timeout):
+        remaining = self.remaining()
+        connect, read = timeout
+        clamped = (min(connect, remaining), min(read, remaining))
+        return clamped, clamped != (connect, read)
+
+    # 等待类操作（线程池结果、对冲请求）的超时
+    def limit(self, timeout):
+        if timeout is None:
+            return self.remaining()
+        return min(timeout, self.remaining())
+
+
+_current_deadline = contextvars.ContextVar("whale_deadline", default=None)
+
+
+# 在指令开始排队时创建 Deadline，执行时用 deadline_scope 生效，排队时间同样计入预算
+@contextmanager
+def deadline_scope(deadline):
+    if deadline is None:
+        yield None
+        return
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def deadline_exceeded():
+    deadline = current_deadline()
+    if deadline is None:
+        return DeadlineExceededError("deadline exceeded")
+    deadline.exceeded = True
+    return DeadlineExceededError(f"deadline of {deadline.budget}s exceeded")
+
+
+# 不在指令范围内（后台刷新、预热）时返回原值
+def limit_timeout(timeout):
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    return deadline.limit(timeout)
@@ -0,0 +1,113 @@
+# executor.py
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.log import logger
+
+
+# 命令执行池：把匹配到的命令放到有界线程池中执行，结果通过回调异步发送
+class CommandExecutor:
+    def __init__(self, max_workers=4, max_queue=32, command_limits=None, default_command_limit=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whale-cmd")
+        # 正在执行 + 排队中的任务总数上限
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._default_command_limit = default_command_limit
+        self._command_limits = {}
+        for command, limit in (command_limits or {}).items():
+            self._command_limits[command] = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.pending = 0
+        # 已提交但还没开始执行的任务：编号 -> 提交时间
+        self._queued = {}
+        # 因指令并发达到上限而等待的任务：指令 -> deque[(run, finish)]，有同一指令的任务结束时按顺序放入线程池
+        self._waiting = {}
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_config(cls, conf):
+        conf = conf or {}
+        return cls(max_workers=int(conf.get("max_workers", 4)),
+                   max_queue=int(conf.get("max_queue", 32)),
+                   command_limits=conf.get("command_limits"),
+                   default_command_limit=conf.get("default_command_limit"))
+
+    def _command_semaphore(self, command):
+        with self._lock:
+            semaphore = self._command_limits.get(command)
+            if semaphore is None and self._default_command_limit:
+                semaphore = threading.BoundedSemaphore(
+                    int(self._default_command_limit))
+                self._command_limits[command] = semaphore
+            return semaphore
+
+    # 队列已满时返回 False，由调用方直接回复繁忙；指令并发达到上限时任务继续排队，不占用工作线程
+    def submit(self, command, task, callback):
+        if not self._slots.acquire(blocking=False):
+            logger.warn(f"[whalePlugin] executor queue full, reject {command}")
+            return False
+        semaphore = self._command_semaphore(command)
+        task_id = next(self._sequence)
+        with self._lock:
+            self.pending += 1
+            self._queued[task_id] = time.monotonic()
+
+        def finish():
+            with self._lock:
+                self.pending -= 1
+                self._queued.pop(task_id, None)
+            self._slots.release()
+            if semaphore is not None:
+                self._release_command(command, semaphore)
+
+        def run():
+            with self._lock:
+                self._queued.pop(task_id, None)
+            try:
+                callback(task())
+            except Exception as e:
+                logger.error(f"[whalePlugin] command {command} failed: {e}")
+            finally:
+                finish()
+
+        if semaphore is not None:
+            with self._lock:
+                if not semaphore.acquire(blocking=False):
+                    self._waiting.setdefault(
+                        command, deque()).append((run, finish))
+                    return True
+        return self._dispatch(run, finish)
+
+    def _dispatch(self, run, finish):
+        try:
+            self._pool.submit(run)
+        except RuntimeError as e:
+            logger.error(f"[whalePlugin] executor unavailable: {e}")
+            finish()
+            return False
+        return True
+
+    # 指令的一个任务结束：有等待的同一指令任务时把并发名额直接交给它，否则归还名额
+    def _release_command(self, command, semaphore):
+        with self._lock:
+            waiting = self._waiting.get(command)
+            queued = waiting.popleft() if waiting else None
+            if queued is None:
+                semaphore.release()
+        if queued is not None:
+            self._dispatch(*queued)
+
+    # 当前排队最久的任务已等待的时间，没有排队任务时为 0
+    # 按实时队列计算而不是历史采样，过载解除后立即恢复，不会因为没有新任务执行而一直处于过载状态
+    def queue_wait(self):
+        with self._lock:
+            oldest = min(self._queued.values(), default=None)
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -1,14 +1,32 @@
 # functions.py
 import requests
 from common.log import logger
-import datetime
-from datetime import timedelta
+from http_client import http_client
+from singleflight import SingleFlight, request_key
+from deadline import DeadlineExceededError, deadline_exceeded, limit_timeout
+from rate_limit import QuotaExceededError, current_scope
+from media_cache import url_validator
+from music_cache import MISSING_URL
+from providers import Provider
+from functools import partial
+import json
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+import contextvars
 from urllib.parse import urlparse
 from bridge.reply import Reply, ReplyType
 
 BASE_URL_VVHAN = "https://api.vvhan.com/api/"
 BASE_URL_ALAPI = "https://v2.alapi.cn/api/"
 
+# 上游请求合并；发起者自身的超时和额度不足不传递给其它调用方
+request_flight = SingleFlight(
+    private_errors=(DeadlineExceededError, QuotaExceededError))
+
+# 上游当天没有内容时的提示
+MOYU_NO_CONTENT = "周末无需摸鱼，愉快玩耍吧"
+BAGUA_NO_CONTENT = "周末不更新，请微博吃瓜"
+
 # 获取帮助信息
 
 
@@ -24,6 +42,9 @@ def create_reply(reply_type, content):
 
 def handle_error(error, message):
     logger.error(f"{message}，错误信息：{error}")
+    scope = current_scope()
+    if scope is not None:
+        scope.failed = True
     return message
 
 # URL 验证
@@ -40,12 +61,8 @@ def is_valid_url(url):
 
 
 def is_valid_image_url(url):
-    try:
-        # Using HEAD request to check the URL header
-        response = requests.head(url)
-        return response.status_code == 200
-    except requests.RequestException as e:
-        return False
+    # HEAD 结果按 URL 缓存，见 media_cache.UrlValidator
+    return url_validator.is_valid(url)
 
 # 加载城市信息
 
@@ -111,89 +128,91 @@ def get_help_text(verbose=False, **kwargs):
     return help_text
 
 
-# 获取早报信息
-def get_morning_news(alapi_token, morning_news_text_enabled, make_request, handle_error, BASE_URL_VVHAN, BASE_URL_ALAPI):
-    if not alapi_token:
-        url = BASE_URL_VVHAN + "60s?type=json"
-        payload = "format=json"
-        headers = {'Content-Type': "application/x-www-form-urlencoded"}
+FORM_HEADERS = {'Content-Type': "application/x-www-form-urlencoded"}
 
-        # 从vvhan获取早报信息
-        try:
-            morning_news_info = make_request(
-                url, method="POST", headers=headers, data=payload)
-            if isinstance(morning_news_info, dict) and morning_news_info['success']:
-                if morning_news_text_enabled:
-                    news_list = ["{}. {}".format(idx, news) for idx, news in enumerate(
-                        morning_news_info["data"][:-1], 1)]
-                    formatted_news = f"☕ {morning_news_info['data']['date']}  今日早报\n" + "\n".join(
-                        news_list)
-                    weiyu = morning_news_info["data"][-1].strip()
-                    return f"{formatted_news}\n\n{weiyu}\n\n 图片url：{morning_news_info['imgUrl']}"
-                else:
-                    return morning_news_info['imgUrl']
-            else:
-                return handle_error(morning_news_info, '早报信息获取失败，可配置"alapi token"切换至 Alapi 服务，或者稍后再试')
-        except Exception as e:
-            return handle_error(e, "出错啦，稍后再试")
-    else:
-        url = BASE_URL_ALAPI + "zaobao"
-        data = {
-            "token": alapi_token,
-            "format": "json"
-        }
-        headers = {'Content-Type': "application/x-www-form-urlencoded"}
+# 解析 vvhan 早报数据，失败返回 None
 
-        # 从alapi获取早报信息
-        try:
-            morning_news_info = make_request(
-                url, method="POST", headers=headers, data=data)
-            if isinstance(morning_news_info, dict) and morning_news_info.get('code') == 200:
-                img_url = morning_news_info['data']['image']
-                if morning_news_text_enabled:
-                    news_list = morning_news_info['data']['news']
-                    weiyu = morning_news_info['data']['weiyu']
-                    formatted_news = f"☕ {morning_news_info['data']['date']}  今日早报\n" + "\n".join(
-                        news_list)
-                    return f"{formatted_news}\n\n{weiyu}\n\n 图片url：{img_url}"
-                else:
-                    return img_url
-            else:
-                return handle_error(morning_news_info, "早报获取失败，请检查 token 是否有误")
-        except Exception as e:
-            return handle_error(e, "早报获取失败")
 
+def parse_morning_news_vvhan(morning_news_info, morning_news_text_enabled):
+    if not (isinstance(morning_news_info, dict) and morning_news_info.get('success')):
+        return None
+    if morning_news_text_enabled:
+        news_list = ["{}. {}".format(idx, news) for idx, news in enumerate(
+            morning_news_info["data"][:-1], 1)]
+        formatted_news = f"☕ {morning_news_info['data']['date']}  今日早报\n" + "\n".join(
+            news_list)
+        weiyu = morning_news_info["data"][-1].strip()
+        return f"{formatted_news}\n\n{weiyu}\n\n 图片url：{morning_news_info['imgUrl']}"
+    return morning_news_info['imgUrl']
+
+# 解析 alapi 早报数据，失败返回 None
 
-# 获取摸鱼日历信息
-def get_moyu_calendar(make_request, is_valid_image_url, BASE_URL_VVHAN):
-    # 尝试从vvhan获取摸鱼日历信息
-    url = BASE_URL_VVHAN + "moyu?type=json"
-    payload = "format=json"
-    headers = {'Content-Type': "application/x-www-form-urlencoded"}
-    moyu_calendar_info = make_request(
-        url, method="POST", headers=headers, data=payload)
 
-    # 验证第一个URL请求是否成功
-    if isinstance(moyu_calendar_info, dict) and moyu_calendar_info['success']:
+def parse_morning_news_alapi(morning_news_info, morning_news_text_enabled):
+    if not (isinstance(morning_news_info, dict) and morning_news_info.get('code') == 200):
+        return None
+    img_url = morning_news_info['data']['image']
+    if morning_news_text_enabled:
+        news_list = morning_news_info['data']['news']
+        weiyu = morning_news_info['data']['weiyu']
+        formatted_news = f"☕ {morning_news_info['data']['date']}  今日早报\n" + "\n".join(
+            news_list)
+        return f"{formatted_news}\n\n{weiyu}\n\n 图片url：{img_url}"
+    return img_url
+
+# 早报数据源：配置了 alapi token 时优先 alapi，vvhan 作为备用
+
+
+def morning_news_providers(alapi_token, morning_news_text_enabled):
+    vvhan = Provider(
+        "vvhan",
+        partial(make_request, BASE_URL_VVHAN + "60s?type=json",
+                method="POST", headers=FORM_HEADERS, data="format=json"),
+        partial(parse_morning_news_vvhan, morning_news_text_enabled=morning_news_text_enabled))
+    if not alapi_token:
+        return [vvhan]
+    alapi = Provider(
+        "alapi",
+        partial(make_request, BASE_URL_ALAPI + "zaobao", method="POST", headers=FORM_HEADERS,
+                data={"token": alapi_token, "format": "json"}),
+        partial(parse_morning_news_alapi, morning_news_text_enabled=morning_news_text_enabled))
+    return [alapi, vvhan]
+
+
+# 解析 vvhan 摸鱼日历数据
+def parse_moyu_vvhan(moyu_calendar_info):
+    if isinstance(moyu_calendar_info, dict) and moyu_calendar_info.get('success'):
         return moyu_calendar_info['url']
-    else:
-        # 第一个URL失败，尝试第二个备用URL
-        url = "https://dayu.qqsuu.cn/moyuribao/apis.php?type=json"
-        moyu_calendar_info = make_request(
-            url, method="POST", headers=headers, data=payload)
-
-        # 验证第二个URL请求是否成功
-        if isinstance(moyu_calendar_info, dict) and moyu_calendar_info['code'] == 200:
-            moyu_pic_url = moyu_calendar_info['data']
-            # 检查图片URL是否有效
-            if is_valid_image_url(moyu_pic_url):
-                return moyu_pic_url
-            else:
-                # 图片URL无效时的备用消息
-                return "周末无需摸鱼，愉快玩耍吧"
-        else:
-            # 两个URL都失败时的备用消息
-            return "暂无可用“摸鱼”服务，认真上班"
+    return None
+
+# 解析 qqsuu 摸鱼日历数据，图片无效时返回周末提示
+
+
+def parse_moyu_qqsuu(moyu_calendar_info, is_valid_image_url):
+    if isinstance(moyu_calendar_info, dict) and moyu_calendar_info.get('code') == 200:
+        moyu_pic_url = moyu_calendar_info['data']
+        # 检查图片URL是否有效
+        if is_valid_image_url(moyu_pic_url):
+            return moyu_pic_url
+        # 图片URL无效时的备用消息
+        return MOYU_NO_CONTENT
+    return None
+
+# 摸鱼日历数据源：vvhan 优先，qqsuu 作为备用
+
+
+def moyu_calendar_providers(is_valid_image_url):
+    return [
+        Provider("vvhan",
+                 partial(make_request, BASE_URL_VVHAN + "moyu?type=json",
+                         method="POST", headers=FORM_HEADERS, data="format=json"),
+                 parse_moyu_vvhan),
+        Provider("qqsuu",
+                 partial(make_request, "https://dayu.qqsuu.cn/moyuribao/apis.php?type=json",
+                         method="POST", headers=FORM_HEADERS, data="format=json"),
+                 partial(parse_moyu_qqsuu, is_valid_image_url=is_valid_image_url)),
+    ]
+
 
 # 获取摸鱼日历视频
 
@@ -216,84 +235,84 @@ def get_moyu_calendar_video(make_request, is_valid_image_url, logger):
     # 未成功请求到视频时，返回提示信息
     return "视频版没了，看看文字版吧"
 
-# 获取星座运势
+# 格式化 vvhan 星座运势，失败返回 None
 
 
-def get_horoscope(make_request, handle_error, BASE_URL_VVHAN, BASE_URL_ALAPI, alapi_token, astro_sign, time_period="today"):
+def parse_horoscope_vvhan(horoscope_data):
+    if not (isinstance(horoscope_data, dict) and horoscope_data.get('success')):
+        return None
+    data = horoscope_data['data']
+    return (
+        f"{data['title']} ({data['time']}):\n\n"
+        f"💡【每日建议】\n宜：{data['todo']['yi']}\n忌：{data['todo']['ji']}\n\n"
+        f"📊【运势指数】\n"
+        f"总运势：{data['index']['all']}\n"
+        f"爱情：{data['index']['love']}\n"
+        f"工作：{data['index']['work']}\n"
+        f"财运：{data['index']['money']}\n"
+        f"健康：{data['index']['health']}\n\n"
+        f"🍀【幸运提示】\n数字：{data['luckynumber']}\n"
+        f"颜色：{data['luckycolor']}\n"
+        f"星座：{data['luckyconstellation']}\n\n"
+        f"✍【简评】\n{data['shortcomment']}\n\n"
+        f"📜【详细运势】\n"
+        f"总运：{data['fortunetext']['all']}\n"
+        f"爱情：{data['fortunetext']['love']}\n"
+        f"工作：{data['fortunetext']['work']}\n"
+        f"财运：{data['fortunetext']['money']}\n"
+        f"健康：{data['fortunetext']['health']}\n"
+    )
+
+# 格式化 alapi 星座运势，失败返回 None
+
+
+def parse_horoscope_alapi(horoscope_data):
+    if not (isinstance(horoscope_data, dict) and horoscope_data.get('code') == 200):
+        return None
+    data = horoscope_data['data']
+    # 接口按 day/tomorrow/week 分组返回时取当天数据
+    data = data.get('day', data)
+    return (
+        f"📅 日期：{data['date']}\n\n"
+        f"💡【每日建议】\n宜：{data['yi']}\n忌：{data['ji']}\n\n"
+        f"📊【运势指数】\n"
+        f"总运势：{data['all']}\n"
+        f"爱情：{data['love']}\n"
+        f"工作：{data['work']}\n"
+        f"财运：{data['money']}\n"
+        f"健康：{data['health']}\n\n"
+        f"🔔【提醒】：{data['notice']}\n\n"
+        f"🍀【幸运提示】\n数字：{data['lucky_number']}\n"
+        f"颜色：{data['lucky_color']}\n"
+        f"星座：{data['lucky_star']}\n\n"
+        f"✍【简评】\n总运：{data['all_text']}\n"
+        f"爱情：{data['love_text']}\n"
+        f"工作：{data['work_text']}\n"
+        f"财运：{data['money_text']}\n"
+        f"健康：{data['health_text']}\n"
+    )
+
+# 星座运势数据源：配置了 alapi token 时优先 alapi，vvhan 作为备用
+
+
+def horoscope_providers(alapi_token, astro_sign, time_period="today"):
+    vvhan = Provider(
+        "vvhan",
+        partial(make_request, BASE_URL_VVHAN + "horoscope", "GET",
+                params={'type': astro_sign, 'time': time_period}),
+        parse_horoscope_vvhan)
     if not alapi_token:
-        url = BASE_URL_VVHAN + "horoscope"
-        params = {
-            'type': astro_sign,
-            'time': time_period
-        }
-        try:
-            horoscope_data = make_request(url, "GET", params=params)
-            if isinstance(horoscope_data, dict) and horoscope_data['success']:
-                # 省略了具体的数据处理和格式化...
-                data = horoscope_data['data']
-                result = result = (
-                    f"{data['title']} ({data['time']}):\n\n"
-                    f"💡【每日建议】\n宜：{data['todo']['yi']}\n忌：{data['todo']['ji']}\n\n"
-                    f"📊【运势指数】\n"
-                    f"总运势：{data['index']['all']}\n"
-                    f"爱情：{data['index']['love']}\n"
-                    f"工作：{data['index']['work']}\n"
-                    f"财运：{data['index']['money']}\n"
-                    f"健康：{data['index']['health']}\n\n"
-                    f"🍀【幸运提示】\n数字：{data['luckynumber']}\n"
-                    f"颜色：{data['luckycolor']}\n"
-                    f"星座：{data['luckyconstellation']}\n\n"
-                    f"✍【简评】\n{data['shortcomment']}\n\n"
-                    f"📜【详细运势】\n"
-                    f"总运：{data['fortunetext']['all']}\n"
-                    f"爱情：{data['fortunetext']['love']}\n"
-                    f"工作：{data['fortunetext']['work']}\n"
-                    f"财运：{data['fortunetext']['money']}\n"
-                    f"健康：{data['fortunetext']['health']}\n"
-                )
-                return result
-            else:
-                return handle_error(horoscope_data, '星座信息获取失败，可配置"alapi token"切换至 Alapi 服务，或者稍后再试')
-        except Exception as e:
-            return handle_error(e, "出错啦，稍后再试")
-    else:
-        # 使用 ALAPI 的 URL 和提供的 token
-        url = BASE_URL_ALAPI + "star"
-        payload = f"token={alapi_token}&star={astro_sign}"
-        headers = {'Content-Type': "application/x-www-form-urlencoded"}
-        try:
-            horoscope_data = make_request(
-                url, method="POST", headers=headers, data=payload)
-            if isinstance(horoscope_data, dict) and horoscope_data.get('code') == 200:
-                # 省略了具体的数据处理和格式化...
-                result = (
-                    f"📅 日期：{data['date']}\n\n"
-                    f"💡【每日建议】\n宜：{data['yi']}\n忌：{data['ji']}\n\n"
-                    f"📊【运势指数】\n"
-                    f"总运势：{data['all']}\n"
-                    f"爱情：{data['love']}\n"
-                    f"工作：{data['work']}\n"
-                    f"财运：{data['money']}\n"
-                    f"健康：{data['health']}\n\n"
-                    f"🔔【提醒】：{data['notice']}\n\n"
-                    f"🍀【幸运提示】\n数字：{data['lucky_number']}\n"
-                    f"颜色：{data['lucky_color']}\n"
-                    f"星座：{data['lucky_star']}\n\n"
-                    f"✍【简评】\n总运：{data['all_text']}\n"
-                    f"爱情：{data['love_text']}\n"
-                    f"工作：{data['work_text']}\n"
-                    f"财运：{data['money_text']}\n"
-                    f"健康：{data['health_text']}\n"
-                )
-                return result
-            else:
-                return handle_error(horoscope_data, "星座获取信息获取失败，请检查 token 是否有误")
-        except Exception as e:
-            return handle_error(e, "出错啦，稍后再试")
+        return [vvhan]
+    alapi = Provider(
+        "alapi",
+        partial(make_request, BASE_URL_ALAPI + "star", method="POST", headers=FORM_HEADERS,
+                data=f"token={alapi_token}&star={astro_sign}"),
+        parse_horoscope_alapi)
+    return [alapi, vvhan]
 
 
 # 获取热榜信息
-def get_hot_trends(make_request, handle_error, BASE_URL_VVHAN, hot_trend_types, whalePlugin, hot_trends_type):
+def get_hot_trends(make_request, handle_error, BASE_URL_VVHAN, hot_trend_types, whalePlugin, hot_trends_type, limit=15):
     # 查找映射字典以获取API参数
     hot_trends_type_en = hot_trend_types.get(hot_trends_type, whalePlugin)
     if hot_trends_type_en is not whalePlugin:
@@ -306,7 +325,7 @@ def get_hot_trends(make_request, handle_error, BASE_URL_VVHAN, hot_trend_types,
                 output = []
                 topics = data['data']
                 output.append(f'更新时间：{data["update_time"]}\n')
-                for i, topic in enumerate(topics[:15], 1):
+                for i, topic in enumerate(topics[:limit], 1):
                     hot = topic.get('hot', '无热度参数, 0')
                     formatted_str = f"{i}. {topic['title']} ({hot} 浏览)\nURL: {topic['url']}\n"
                     output.append(formatted_str)
@@ -324,45 +343,151 @@ def get_hot_trends(make_request, handle_error, BASE_URL_VVHAN, hot_trend_types,
         return final_output
 
 
-def get_weather(alapi_token, city_or_id: str, date: str, content):
-    # 根据日期确定 API 端点
-    url = BASE_URL_ALAPI + \
-        ('tianqi' if date not in ['明天', '后天', '七天', '7天'] else 'tianqi/seven')
+FUTURE_WEATHER_DATES = ['明天', '后天', '七天', '7天']
+
+# 获取天气数据：优先从天气缓存读取，返回接口数据或错误提示字符串
+
+
+def load_weather(alapi_token, city_or_id: str, kind, content, city_index=None, weather_store=None):
+    url = BASE_URL_ALAPI + kind
 
     # 确定 city_or_id 是城市 ID 还是城市名称
     if city_or_id.isnumeric():
-        params = {'city_id': city_or_id, 'token': alapi_token}
+        city_id = city_or_id
     else:
-        city_info = check_multiple_city_ids(city_or_id)
-        if city_info:
+        city_match = city_index.resolve(city_or_id) if city_index else None
+        if city_match and city_match.ambiguous:
             # 如果找到多个城市 ID，提示用户使用 ID 进行查询
-            data = city_info['data']
             formatted_city_info = "\n".join(
-                [f"{idx + 1}) {entry['province']}--{entry['leader']}, ID: {entry['city_id']}" for idx, entry in enumerate(data)])
+                [f"{idx + 1}) {entry['province']}--{entry['leader']}, ID: {entry['city_id']}" for idx, entry in enumerate(city_match.entries)])
             return f"找到 <{city_or_id}> 多个数据：\n{formatted_city_info}\n请使用 ID 进行查询，发送 'id+天气'"
-
+        if not city_match and city_index and city_index.is_rejected(city_or_id):
+            # 已确认无效的城市名不再请求接口
+            return format_unknown_city(city_or_id, city_index)
+        # 本地已知的城市直接按 ID 查询
+        city_id = city_match.city_id if city_match else None
+
+    if weather_store:
+        data = weather_store.get(city_id, kind)
+        if data is not None:
+            return data
+
+    if city_id:
+        params = {'city_id': city_id, 'token': alapi_token}
+    else:
         params = {'city': city_or_id, 'token': alapi_token}
 
-    try:
-        # 发起 API 请求
-        weather_data = make_request(url, "GET", params=params)
+    # 发起 API 请求
+    weather_data = make_request(url, "GET", params=params)
+    if not isinstance(weather_data, dict) or weather_data.get('code') != 200:
+        return handle_error(weather_data, "天气查询失败，请稍后再试")
+
+    data = weather_data['data']
+    city_data = data[0] if isinstance(data, list) and data else data
+
+    # 接口对无法识别的城市名会返回默认城市，记录为无效城市名
+    if not city_or_id.isnumeric() and city_data['city'] not in content:
+        if city_index:
+            city_index.reject(city_or_id)
+            return format_unknown_city(city_or_id, city_index)
+        return "输入格式不正确。请输入<城市+(今天|明天|后天|七天)+天气>，例如 '广州天气'"
+    if not city_id:
+        city_id = city_data.get('city_id')
+        if city_index:
+            city_index.learn(city_or_id, city_id,
+                             city_data.get('province', ''))
+    if weather_store:
+        weather_store.put(city_id, kind, data)
+    return data
 
-        if isinstance(weather_data, dict) and weather_data.get('code') == 200:
-            data = weather_data['data']
 
-            # 处理未来天气数据
-            if date in ['明天', '后天', '七天', '7天']:
-                formatted_output = process_future_weather(data, date)
-                return "\n".join(formatted_output)
+def get_weather(alapi_token, city_or_id: str, date: str, content, city_index=None, weather_store=None):
+    # 根据日期确定 API 端点
+    kind = 'tianqi' if date not in FUTURE_WEATHER_DATES else 'tianqi/seven'
 
-            # 处理当前天气数据
-            formatted_output = process_current_weather(
-                data, content, city_or_id)
+    try:
+        data = load_weather(alapi_token, city_or_id, kind,
+                            content, city_index, weather_store)
+        if isinstance(data, str):
+            return data
+
+        # 处理未来天气数据
+        if date in FUTURE_WEATHER_DATES:
+            formatted_output = process_future_weather(data, date)
             return "\n".join(formatted_output)
+
+        # 处理当前天气数据
+        formatted_output = process_current_weather(
+            data, content, city_or_id)
+        if isinstance(formatted_output, str):
+            return formatted_output
+        return "\n".join(formatted_output)
     except Exception as e:
         return f"发生错误：{e}"
 
 
+# 多城市天气：用有界线程池并发查询每个城市，合并为一条简要回复
+def get_weather_multi(alapi_token, cities, date, city_index=None, weather_store=None, max_workers=4, timeout=8.0):
+    kind = 'tianqi' if date not in FUTURE_WEATHER_DATES else 'tianqi/seven'
+    results = {}
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="whale-weather")
+    try:
+        # 每个城市单独构造消息内容，避免接口返回的默认城市恰好是同一条消息中的另一个城市
+        futures = {executor.submit(contextvars.copy_context().run, load_weather, alapi_token, city, kind,
+                                   f"{city}{date}天气", city_index, weather_store): city
+                   for city in cities}
+        done, _ = wait(futures, timeout=limit_timeout(timeout))
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = f"发生错误：{e}"
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    sections = []
+    for city in cities:
+        data = results.get(city)
+        if data is None:
+            sections.append(f"🏙️ {city}: 查询超时，请稍后重试\n")
+        elif isinstance(data, str):
+            sections.append(f"🏙️ {city}: {data}\n")
+        else:
+            # 单个城市的数据格式异常时只影响该城市，其它城市照常回复
+            try:
+                sections.append(format_city_weather(city, data, date))
+            except Exception as e:
+                logger.error(f"weather format for {city} failed: {e}")
+                sections.append(f"🏙️ {city}: 发生错误：{e}\n")
+    return "\n".join(sections)
+
+
+# 多城市天气中单个城市的简要信息
+def format_city_weather(city, data, date):
+    if date in FUTURE_WEATHER_DATES:
+        return "".join(process_future_weather(data, date))
+    formatted_output = process_current_weather(
+        data, f"{city}{date}天气", city)
+    if isinstance(formatted_output, str):
+        return f"🏙️ {city}: {formatted_output}\n"
+    # 只保留基本信息，预警只列出标题
+    section = formatted_output[0]
+    if data.get('alarm'):
+        section += "⚠️ 预警: " + \
+            "、".join(alarm['title'] for alarm in data['alarm']) + "\n"
+    return section
+
+
+# 无效城市名的提示，附带相近的城市名
+def format_unknown_city(city, city_index):
+    suggestions = city_index.suggest(city)
+    message = f"未找到城市 <{city}>，请检查城市名称"
+    if suggestions:
+        message += "，你是不是要查询：" + "、".join(suggestions)
+    return message
+
+
 def process_future_weather(data, date):
     # 处理和格式化未来天气数据
     formatted_output = []
@@ -387,15 +512,21 @@ def process_future_weather(data, date):
 
 def make_request(url, method="GET", headers=None, params=None, data=None, json_data=None):
     try:
-        if method.upper() == "GET":
-            response = requests.get(url, headers=headers, params=params)
-        elif method.upper() == "POST":
-            response = requests.post(
-                url, headers=headers, data=data, json=json_data)
-        else:
+        if method.upper() not in ("GET", "POST"):
             return {"success": False, "message": "不支持的 HTTP 方法"}
 
-        return response.json()
+        # 统一走共享客户端：连接复用、按主机超时、幂等请求自动重试
+        def fetch():
+            response = http_client.request(
+                method.upper(), url, headers=headers, params=params, data=data, json=json_data)
+            return response.json()
+
+        # 相同的并发请求只发一次，所有调用方共享结果（上游异常同样传递给每个调用方）
+        key = request_key(method, url, headers=headers,
+                          params=params, data=data, json_data=json_data)
+        return request_flight.do(key, fetch, timeout=limit_timeout(None))
+    except TimeoutError:
+        return deadline_exceeded()
     except Exception as e:
         return e
 
@@ -469,10 +600,9 @@ def get_mx_bagua(make_request, is_valid_image_url):
         if is_valid_image_url(bagua_pic_url):
             return bagua_pic_url
         else:
-            return "周末不更新，请微博吃瓜"
+            return BAGUA_NO_CONTENT
     else:
-        logger.error(f"错误信息：{bagua_info}")
-        return "暂无明星八卦，吃瓜莫急"
+        return handle_error(bagua_info, "暂无明星八卦，吃瓜莫急")
 
 # 获取每日一题
 
@@ -496,72 +626,144 @@ def fetch_daily_question():
     }
     """
     # 发起请求
-    response = requests.post(base_url, json={'query': query}, headers=headers)
-    if response.status_code == 200:
+    data = make_request(base_url, method="POST",
+                        headers=headers, json_data={'query': query})
+    if isinstance(data, dict):
         try:
-            data = response.json()
             question = data['data']['activeDailyCodingChallengeQuestion']['question']
             title = f"{question['questionFrontendId']}. {question['title']}"
             title_slug = question['titleSlug']
             url = f"https://leetcode.com/problems/{title_slug}"
             return title, url
-        except KeyError as e:
-            print(f"Error parsing response JSON: {e}")
+        except (KeyError, TypeError) as e:
+            logger.error(f"Error parsing response JSON: {e}")
             return None, None
     else:
-        print(f"Failed to fetch daily question: {response.status_code}")
+        logger.error(f"Failed to fetch daily question: {data}")
         return None, None
 
-# 网易云音乐搜索
+# 获取单首歌曲的播放链接
+
+
+def resolve_song_url(api_key, song_id):
+    url_payload = {"id": str(song_id), "format": "json", "token": api_key}
+    url_info = make_request(
+        "https://v2.alapi.cn/api/music/url", "GET", params=url_payload)
+    if isinstance(url_info, dict) and url_info.get('code') == 200:
+        # 接口正常但没有播放链接（如版权限制）时返回空字符串，与请求失败的 None 区分
+        return url_info['data']['url'] or ""
+    return None
+
+# 批量获取播放链接（id 以逗号分隔），接口不支持批量时返回 None
+
+
+def resolve_song_urls_batch(api_key, song_ids):
+    url_payload = {"id": ",".join(str(song_id) for song_id in song_ids),
+                   "format": "json", "token": api_key}
+    url_info = make_request(
+        "https://v2.alapi.cn/api/music/url", "GET", params=url_payload)
+    if isinstance(url_info, dict) and url_info.get('code') == 200 and isinstance(url_info.get('data'), list):
+        urls = {str(item['id']): item.get('url') or "" for item in url_info['data']}
+        # 接口返回了但没有播放链接的歌曲与 resolve_song_url 一致记为空字符串，以便缓存
+        return {str(song_id): urls[str(song_id)] for song_id in song_ids if str(song_id) in urls}
+    return None
+
+# 超时未解析的播放链接占位
+PENDING_URL = object()
+
+# 并发获取播放链接，返回 {song_id: url}，超过 timeout 仍未返回的歌曲记为 PENDING_URL
 
 
-def music_search(api_key, keyword):
-    # 第一步：搜索音乐
+def resolve_song_urls(api_key, song_ids, max_workers=5, timeout=6.0):
+    urls = {}
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="whale-music")
+    try:
+        # 复制当前上下文，让限流等按消息生效的设置在线程池中同样生效
+        futures = {executor.submit(contextvars.copy_context().run, resolve_song_url, api_key, song_id): str(song_id)
+                   for song_id in song_ids}
+        done, not_done = wait(futures, timeout=limit_timeout(timeout))
+        for future in done:
+            try:
+                urls[futures[future]] = future.result()
+            except Exception as e:
+                logger.error(f"music url 获取失败，错误信息：{e}")
+                urls[futures[future]] = None
+        for future in not_done:
+            urls[futures[future]] = PENDING_URL
+    finally:
+        # 不等待超时的请求，直接把已完成的结果返回给用户
+        executor.shutdown(wait=False, cancel_futures=True)
+    return urls
+
+# 搜索歌曲，返回歌曲信息列表，失败返回 None
+
+
+def search_songs(api_key, keyword):
     search_url = "https://v2.alapi.cn/api/music/search"
     search_payload = {"token": api_key, "keyword": keyword}
     search_headers = {'Content-Type': "application/x-www-form-urlencoded"}
+    search_info = make_request(
+        search_url, method="POST", headers=search_headers, data=search_payload)
 
-    try:
-        search_response = requests.request(
-            "POST", search_url, data=search_payload, headers=search_headers)
-        search_info = search_response.json()
+    if not isinstance(search_info, dict) or search_info.get('code') != 200:  # 如果请求不成功，抛出异常
+        logger.error(f"music_search失败，错误信息：{search_info}")
+        return None
 
-        if search_info['code'] != 200:  # 如果请求不成功，抛出异常
-            logger.error(f"music_search失败，错误信息：{search_info}")
-            return None
+    return [{
+        "id": str(song['id']),
+        # 获取歌曲名称
+        "song_name": song['name'],
+        # 获取歌手
+        "artists": ", ".join([artist['name'] for artist in song['artists']]),
+        # 获取时长，单位为毫秒，转换为秒需要除以1000
+        "duration": song['duration'] / 1000,
+    } for song in search_info['data']['songs']]
 
-        # 第二步：对每首歌曲获取其URL
-        songs_info = search_info['data']['songs']
-        result = []
-        for song in songs_info:
-            song_id = song['id']
+# 网易云音乐搜索，music_cache 为 music_cache.MusicCache 时复用缓存的搜索结果和未过期的播放链接
 
-            url_payload = {
-                "id": str(song_id), "format": "json", "token": api_key}
-            url_response = requests.request(
-                "GET", "https://v2.alapi.cn/api/music/url", params=url_payload)
 
-            url_info = url_response.json()
-            if url_info['code'] == 200:
-                song['url'] = url_info['data']['url']  # 将URL添加到歌曲信息中
-            else:
-                continue
-
-            # 获取歌曲名称
-            song_name = song['name']
-            # 获取歌手
-            artists = ", ".join([artist['name'] for artist in song['artists']])
-            # 获取时长，单位为毫秒，转换为秒需要除以1000
-            duration = song['duration'] / 1000
-            # 获取url
-            url = song['url']
+def music_search(api_key, keyword, max_workers=5, timeout=6.0, batch=False, music_cache=None):
+    try:
+        # 第一步：搜索音乐
+        songs = music_cache.get_songs(keyword) if music_cache else None
+        if songs is None:
+            songs = search_songs(api_key, keyword)
+            if songs is None:
+                return None
+            if music_cache:
+                music_cache.put_songs(keyword, songs)
+
+        # 第二步：获取歌曲URL，只请求没有缓存或已过期的链接，优先批量，否则并发逐首获取
+        urls = {}
+        for song in songs:
+            url = music_cache.get_url(song['id']) if music_cache else MISSING_URL
+            if url is not MISSING_URL:
+                urls[song['id']] = url
+        missing = [song['id'] for song in songs if song['id'] not in urls]
+        if missing:
+            resolved = resolve_song_urls_batch(
+                api_key, missing) if batch else None
+            if resolved is None:
+                resolved = resolve_song_urls(
+                    api_key, missing, max_workers=max_workers, timeout=timeout)
+            for song_id, url in resolved.items():
+                # 请求失败（None）或超时未解析的链接不缓存，下次重新获取
+                if music_cache and url is not None and url is not PENDING_URL:
+                    music_cache.put_url(song_id, url)
+            urls.update(resolved)
 
-            # 保存结果
+        result = []
+        for song in songs:
+            url = urls.get(song['id'])
+            if not url:
+                continue
+            # 保存结果，超时未解析的链接记为 None
             result.append({
-                "song_name": song_name,
-                "artists": artists,
-                "duration": duration,
-                "url": url,
+                "song_name": song['song_name'],
+                "artists": song['artists'],
+                "duration": song['duration'],
+                "url": None if url is PENDING_URL else url,
             })
 
         if len(result) > 0:
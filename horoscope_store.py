@@ -0,0 +1,68 @@
+# horoscope_store.py
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from cache import DailyCache
+from common.log import logger
+
+
+# 星座运势：每天并发拉取全部星座并保存渲染好的回复，查询时直接查表
+# 当天还没有某个星座时先同步拉取这一个，再在后台补齐其余星座
+class HoroscopeStore:
+    def __init__(self, load, signs, cutover="00:10", max_workers=4, timeout=30.0, store=None):
+        self.load = load
+        self.signs = list(signs)
+        self.timeout = timeout
+        self._cache = DailyCache(cutover=cutover, maxsize=len(
+            self.signs) * 2, store=store)
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whale-horoscope")
+        self._lock = threading.Lock()
+        self._batch_day = None
+
+    @classmethod
+    def from_config(cls, conf, load, signs, store=None):
+        conf = conf or {}
+        return cls(load, signs,
+                   cutover=conf.get("cutover", "00:10"),
+                   max_workers=int(conf.get("max_workers", 4)),
+                   timeout=float(conf.get("timeout", 30.0)),
+                   store=store)
+
+    def _load_sign(self, sign):
+        return self._cache.get_or_load(sign, lambda: self.load(sign),
+                                       should_cache=lambda value: value is not None)
+
+    # 拉取当天还没有的星座，全部就绪时返回 True
+    def refresh(self):
+        missing = [sign for sign in self.signs if self._cache.get(sign) is None]
+        if missing:
+            futures = [self._pool.submit(contextvars.copy_context().run, self._load_sign, sign)
+                       for sign in missing]
+            wait(futures, timeout=self.timeout)
+        ready = sum(1 for sign in self.signs if self._cache.get(sign) is not None)
+        logger.debug(
+            f"[whalePlugin] horoscope batch: {ready}/{len(self.signs)} ready")
+        return ready == len(self.signs)
+
+    # 每个内容日最多在后台补齐一次，失败的星座在下次查询时单独拉取
+    def _refresh_in_background(self):
+        day = self._cache.content_day(self.signs[0])
+        with self._lock:
+            if self._batch_day == day:
+                return
+            self._batch_day = day
+        threading.Thread(target=self.refresh,
+                         name="whale-horoscope-batch", daemon=True).start()
+
+    def get(self, sign):
+        value = self._cache.get(sign)
+        if value is not None:
+            return value
+        value = self._load_sign(sign)
+        self._refresh_in_background()
+        return value
+
+    def stats(self):
+        return self._cache.stats()
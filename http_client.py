@@ -0,0 +1,204 @@
+# http_client.py
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+from urllib3.util.retry import Retry
+from common.log import logger
+from breaker import BreakerRegistry, CircuitOpenError
+from deadline import current_deadline, deadline_exceeded
+from metrics import UPSTREAM_LATENCY, UPSTREAM_TOTAL
+
+# 默认超时 (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# 各上游的默认超时，可在 config.json 的 http.host_timeouts 中覆盖
+DEFAULT_HOST_TIMEOUTS = {
+    "api.vvhan.com": (3.05, 8),
+    "v2.alapi.cn": (3.05, 8),
+    "dayu.qqsuu.cn": (3.05, 10),
+    "leetcode.com": (5, 10),
+}
+
+# 只对幂等方法重试，避免重复提交
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _to_timeout(value, default):
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return (float(value), float(value))
+    connect, read = value
+    return (float(connect), float(read))
+
+
+# 是否为超时：重试次数用完后 urllib3 把超时包装在 MaxRetryError 中，requests 抛出的是 ConnectionError 而不是 Timeout
+def _timed_out(error):
+    if isinstance(error, requests.Timeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, (ConnectTimeoutError, ReadTimeoutError))
+
+
+# 共享的 HTTP 客户端：每个上游主机一个 Session，连接复用 + 有界连接池
+class HttpClient:
+    def __init__(self, pool_maxsize=10, max_retries=2, backoff_factor=0.3,
+                 timeout=DEFAULT_TIMEOUT, host_timeouts=None):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = _to_timeout(timeout, DEFAULT_TIMEOUT)
+        self.host_timeouts = dict(DEFAULT_HOST_TIMEOUTS)
+        self.host_timeouts.update(host_timeouts or {})
+        self.breakers = BreakerRegistry()
+        # 上游地址替换，例如 {"https://api.vvhan.com": "http://127.0.0.1:8080/vvhan"}，用于镜像或本地压测
+        self.base_overrides = {}
+        # 上游额度控制，见 rate_limit.RateLimiter
+        self.limiter = None
+        # 正在进行的上游请求数，供准入控制判断是否过载
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def configure(self, conf):
+        # 根据 config.json 中的 http 配置重建客户端
+        conf = conf or {}
+        with self._lock:
+            self.pool_maxsize = int(conf.get("pool_maxsize", self.pool_maxsize))
+            self.max_retries = int(conf.get("max_retries", self.max_retries))
+            self.backoff_factor = float(
+                conf.get("backoff_factor", self.backoff_factor))
+            self.timeout = _to_timeout(conf.get("timeout"), self.timeout)
+            for host, value in (conf.get("host_timeouts") or {}).items():
+                self.host_timeouts[host] = _to_timeout(value, self.timeout)
+            self.base_overrides = dict(conf.get("base_overrides") or {})
+            sessions, self._sessions = self._sessions, {}
+        self.breakers.configure(conf.get("circuit_breaker"))
+        for session in sessions.values():
+            session.close()
+
+    def _rewrite(self, url):
+        for base, target in self.base_overrides.items():
+            if url.startswith(base):
+                return target.rstrip("/") + url[len(base):]
+        return url
+
+    def timeout_for(self, host):
+        return self.host_timeouts.get(host, self.timeout)
+
+    def _build_session(self, retries):
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        # pool_block=False：超出 pool_maxsize 的连接用完即关闭，不会无限等待空闲连接
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize,
+                              max_retries=retry, pool_block=False)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _session(self, host, retries=None):
+        if retries is None:
+            retries = self.max_retries
+        with self._lock:
+            session = self._sessions.get((host, retries))
+            if session is None:
+                session = self._build_session(retries)
+                self._sessions[(host, retries)] = session
+                logger.debug(
+                    f"[whalePlugin] new http session for {host} (retries={retries})")
+            return session
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).hostname or ""
+        # 指令的总耗时预算已用完时不再发出请求
+        deadline = current_deadline()
+        if deadline is not None and deadline.expired():
+            UPSTREAM_TOTAL.inc(host=host, outcome="deadline")
+            raise deadline_exceeded()
+        # 熔断器打开时直接失败，调用方立即走备用数据源或缓存；先于额度检查，被熔断拒绝的请求不消耗额度
+        breaker = self.breakers.get(host)
+        if not breaker.allow():
+            UPSTREAM_TOTAL.inc(host=host, outcome="circuit_open")
+            raise CircuitOpenError(f"circuit open for {host}")
+        limited = self.limiter is not None and self.limiter.limits(url)
+        if limited:
+            try:
+                self.limiter.acquire(url)
+            except requests.RequestException:
+                breaker.release()
+                UPSTREAM_TOTAL.inc(host=host, outcome="quota")
+                raise
+        kwargs.setdefault(
+            "timeout", breaker.adaptive_timeout(self.timeout_for(host)))
+        clamped = False
+        retries = None
+        if deadline is not None:
+            kwargs["timeout"], clamped = deadline.clamp(
+                _to_timeout(kwargs["timeout"], self.timeout))
+            # 只保留剩余预算内能容纳的重试次数（每次尝试按读取超时计算），保证不超过截止时间
+            read_timeout = kwargs["timeout"][1]
+            if read_timeout > 0:
+                retries = max(0, min(self.max_retries,
+                                     int(deadline.remaining() // read_timeout) - 1))
+            else:
+                retries = 0
+        # 受额度控制的主机不做传输层重试：每次实际请求都要计入额度，重试会让每日额度少算
+        if limited:
+            retries = 0
+        start = time.time()
+        with self._in_flight_lock:
+            self.in_flight += 1
+        try:
+            response = self._session(host, retries).request(
+                method, self._rewrite(url), **kwargs)
+        except requests.RequestException as e:
+            UPSTREAM_LATENCY.observe(time.time() - start, host=host)
+            if clamped and (_timed_out(e) or deadline.expired()):
+                # 超时是因为预算不足被截断，不算上游故障
+                breaker.release()
+                UPSTREAM_TOTAL.inc(host=host, outcome="deadline")
+                raise deadline_exceeded() from e
+            breaker.record_failure()
+            UPSTREAM_TOTAL.inc(host=host, outcome="error")
+            raise
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+        latency = time.time() - start
+        UPSTREAM_LATENCY.observe(latency, host=host)
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+            UPSTREAM_TOTAL.inc(host=host, outcome="error")
+        else:
+            breaker.record_success(latency)
+            UPSTREAM_TOTAL.inc(host=host, outcome="ok")
+        return response
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+http_client = HttpClient()
+
+
+def configure_http_client(conf):
+    http_client.configure(conf)
+    return http_client
@@ -0,0 +1,268 @@
+# media_cache.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+from common.log import logger
+from deadline import DeadlineExceededError
+from http_client import http_client
+from singleflight import SingleFlight
+
+
+class _Validation:
+    def __init__(self, valid, expires_at, etag=None, last_modified=None):
+        self.valid = valid
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+# 图片/视频链接有效性缓存：按 URL 记录 HEAD 结果、ETag/Last-Modified 和过期时间
+# 过期后带条件头重新验证，304 直接续期；无效链接按较短的 negative_ttl 缓存
+class UrlValidator:
+    def __init__(self, maxsize=256, ttl=3600, negative_ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, conf):
+        conf = conf or {}
+        with self._lock:
+            self.maxsize = int(conf.get("maxsize", self.maxsize))
+            self.ttl = float(conf.get("ttl", self.ttl))
+            self.negative_ttl = float(
+                conf.get("negative_ttl", self.negative_ttl))
+
+    def _store(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def is_valid(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+                if entry.expires_at > time.time():
+                    self.hits += 1
+                    return entry.valid
+            self.misses += 1
+
+        headers = {}
+        if entry is not None and entry.valid:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        try:
+            response = http_client.request("HEAD", url, headers=headers)
+        except DeadlineExceededError:
+            # 预算用完不代表链接无效，不缓存结果
+            return False
+        except requests.RequestException as e:
+            logger.debug(f"[whalePlugin] HEAD {url} failed: {e}")
+            self._store(url, _Validation(
+                False, time.time() + self.negative_ttl))
+            return False
+
+        if response.status_code == 304 and entry is not None:
+            entry.expires_at = time.time() + self.ttl
+            self._store(url, entry)
+            return True
+        valid = response.status_code == 200
+        ttl = self.ttl if valid else self.negative_ttl
+        self._store(url, _Validation(valid, time.time() + ttl,
+                                     response.headers.get("ETag"),
+                                     response.headers.get("Last-Modified")))
+        return valid
+
+    def evict(self, url=None):
+        with self._lock:
+            if url is None:
+                self.evictions += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(url, None) is not None:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+url_validator = UrlValidator()
+
+
+def configure_url_validator(conf):
+    url_validator.configure(conf)
+    return url_validator
+
+
+# 本地媒体缓存：图片/视频按内容 SHA-256 命名保存在磁盘上，同一个文件只下载一次
+# 下载时分块写入临时文件，不在内存中缓存整个视频；总大小超过 max_bytes 时按最近使用时间淘汰
+class MediaCache:
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024, max_file_bytes=100 * 1024 * 1024,
+                 chunk_size=64 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.chunk_size = chunk_size
+        self._urls = {}  # url -> 文件名
+        self._files = OrderedDict()  # 文件名 -> 大小，按最近使用排序
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.downloads = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def from_config(cls, conf, base_dir):
+        conf = conf or {}
+        directory = os.path.join(base_dir, conf.get("directory", "media_cache"))
+        return cls(directory,
+                   max_bytes=int(conf.get("max_mb", 500)) * 1024 * 1024,
+                   max_file_bytes=int(conf.get("max_file_mb", 100)) * 1024 * 1024,
+                   chunk_size=int(conf.get("chunk_size", 64 * 1024)))
+
+    # 重启后从磁盘恢复：文件按修改时间排序作为最近使用顺序
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX_FILE), "r", encoding="utf-8") as f:
+                urls = json.load(f)
+        except (OSError, ValueError):
+            urls = {}
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name == self.INDEX_FILE or not os.path.isfile(path):
+                continue
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._files[name] = size
+        self._urls = {url: name for url, name in urls.items()
+                      if name in self._files}
+
+    def _save_index(self):
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._urls, f)
+        os.replace(tmp_path, path)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _touch(self, name):
+        self._files.move_to_end(name)
+        try:
+            os.utime(self._path(name))
+        except OSError:
+            pass
+
+    def _lookup(self, url):
+        name = self._urls.get(url)
+        if name is not None and name in self._files and os.path.exists(self._path(name)):
+            self._touch(name)
+            return self._path(name)
+        return None
+
+    # 已缓存时返回本地路径，否则返回 None
+    def get(self, url):
+        with self._lock:
+            path = self._lookup(url)
+            if path is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return path
+
+    # 返回本地路径，未缓存时下载；同一个 URL 的并发下载只发出一次请求，失败时返回 None
+    def fetch(self, url):
+        path = self.get(url)
+        if path is not None:
+            return path
+        try:
+            return self._flight.do(url, lambda: self._download(url))
+        except (requests.RequestException, OSError) as e:
+            logger.warn(f"[whalePlugin] media download {url} failed: {e}")
+            return None
+
+    def _download(self, url):
+        with self._lock:
+            path = self._lookup(url)
+        if path is not None:
+            return path
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f, http_client.request("GET", url, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise OSError(
+                            f"media larger than {self.max_file_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            extension = os.path.splitext(urlparse(url).path)[1][:8]
+            name = digest.hexdigest() + extension
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.downloads += 1
+            self._files[name] = size
+            self._touch(name)
+            self._urls[url] = name
+            self._evict_over_budget(keep=name)
+            self._save_index()
+        logger.debug(f"[whalePlugin] media cached {url} -> {name} ({size} bytes)")
+        return self._path(name)
+
+    def _evict_over_budget(self, keep):
+        total = sum(self._files.values())
+        for name in list(self._files):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self._files.pop(name)
+            self.evictions += 1
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        self._urls = {url: name for url, name in self._urls.items()
+                      if name in self._files}
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._files), "bytes": sum(self._files.values()),
+                    "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "downloads": self.downloads}
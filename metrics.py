@@ -0,0 +1,212 @@
+# metrics.py
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.log import logger
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def values(self):
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    # 按桶线性插值估算分位数
+    def quantile(self, q, **labels):
+        entry = self.values().get(_label_key(labels))
+        if entry is None or entry[2] == 0:
+            return None
+        counts, _, count = entry
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            if bound != float("inf"):
+                lower = bound
+        return lower
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# 指标注册表：计数器、直方图，以及按需读取的缓存统计（由各缓存的 stats() 提供）
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def register_cache(self, name, stats):
+        with self._lock:
+            self._caches[name] = stats
+
+    def cache_stats(self):
+        with self._lock:
+            caches = dict(self._caches)
+        result = {}
+        for name, stats in caches.items():
+            try:
+                result[name] = stats()
+            except Exception as e:
+                logger.error(f"[whalePlugin] cache stats {name} failed: {e}")
+        return result
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        cache_stats = self.cache_stats()
+        for field in ("hits", "misses", "evictions"):
+            name = f"whale_cache_{field}_total"
+            lines.append(f"# HELP {name} Cache {field}.")
+            lines.append(f"# TYPE {name} counter")
+            for cache, stats in sorted(cache_stats.items()):
+                if field in stats:
+                    lines.append(f'{name}{{cache="{cache}"}} {stats[field]}')
+        return "\n".join(lines) + "\n"
+
+    # 以原子替换的方式写出 Prometheus 文本格式文件（node_exporter textfile collector）
+    def write_textfile(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+        return True
+
+
+metrics = MetricsRegistry()
+
+COMMAND_TOTAL = metrics.counter(
+    "whale_commands_total", "Commands handled by whalePlugin.")
+COMMAND_LATENCY = metrics.histogram(
+    "whale_command_latency_seconds", "Command handling latency.")
+UPSTREAM_TOTAL = metrics.counter(
+    "whale_upstream_requests_total", "Upstream HTTP requests by host and outcome.")
+UPSTREAM_LATENCY = metrics.histogram(
+    "whale_upstream_latency_seconds", "Upstream HTTP request latency.")
+BROADCAST_TOTAL = metrics.counter(
+    "whale_broadcast_sends_total", "Subscription broadcast sends by topic and outcome.")
+
+
+# 本地 HTTP 端点，GET /metrics 返回 Prometheus 文本格式
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=9464):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry_ref.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="whale-metrics", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
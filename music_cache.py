@@ -0,0 +1,86 @@
+# music_cache.py
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+from cache import TTLCache
+
+MISSING_URL = object()
+
+EXPIRY_PARAMS = ("expires", "Expires", "x-expires", "e")
+TIMESTAMP_SEGMENT = re.compile(r"^\d{14}$")
+# 网易云 CDN 路径中的时间为北京时间，不能按服务器本地时区解析
+CDN_TIMEZONE = timezone(timedelta(hours=8))
+
+
+# 播放链接自身携带的过期时间：查询参数中的 Unix 时间戳，或网易云 CDN 路径首段的 yyyyMMddHHmmss
+def url_expires_at(url):
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    for name in EXPIRY_PARAMS:
+        value = query.get(name, [None])[0]
+        if value and value.isdigit():
+            return float(value)
+    segment = parsed.path.lstrip("/").split("/", 1)[0]
+    if TIMESTAMP_SEGMENT.match(segment):
+        try:
+            return datetime.strptime(segment, "%Y%m%d%H%M%S").replace(
+                tzinfo=CDN_TIMEZONE).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+# 音乐搜索缓存：按规范化后的关键词保存歌曲信息，播放链接按歌曲单独保存
+# 播放链接有时效，每条链接按自身的过期时间（提前 refresh_margin 秒）失效，只重新获取过期的链接
+class MusicCache:
+    def __init__(self, maxsize=256, search_ttl=86400, url_maxsize=2048, url_ttl=1200,
+                 unavailable_ttl=3600, refresh_margin=60):
+        self.url_ttl = url_ttl
+        self.unavailable_ttl = unavailable_ttl
+        self.refresh_margin = refresh_margin
+        self._searches = TTLCache(maxsize=maxsize, default_ttl=search_ttl)
+        self._urls = TTLCache(maxsize=url_maxsize, default_ttl=url_ttl)
+
+    @classmethod
+    def from_config(cls, conf):
+        conf = conf or {}
+        return cls(maxsize=int(conf.get("maxsize", 256)),
+                   search_ttl=float(conf.get("search_ttl", 86400)),
+                   url_maxsize=int(conf.get("url_maxsize", 2048)),
+                   url_ttl=float(conf.get("url_ttl", 1200)),
+                   unavailable_ttl=float(conf.get("unavailable_ttl", 3600)),
+                   refresh_margin=float(conf.get("refresh_margin", 60)))
+
+    @staticmethod
+    def normalize(keyword):
+        return " ".join(unicodedata.normalize("NFKC", keyword).lower().split())
+
+    def get_songs(self, keyword):
+        return self._searches.get(self.normalize(keyword))
+
+    def put_songs(self, keyword, songs):
+        self._searches.set(self.normalize(keyword), songs)
+
+    # 返回播放链接；空字符串表示该歌曲暂无播放链接（如版权限制），未缓存或已过期时返回 MISSING_URL
+    def get_url(self, song_id):
+        return self._urls.get(str(song_id), MISSING_URL)
+
+    def put_url(self, song_id, url):
+        now = time.time()
+        if not url:
+            expires_at = now + self.unavailable_ttl
+        else:
+            expires_at = (url_expires_at(url) or now +
+                          self.url_ttl) - self.refresh_margin
+            if expires_at <= now:
+                return
+        self._urls.set(str(song_id), url, expires_at=expires_at)
+
+    def stats(self):
+        return self._searches.stats()
+
+    def url_stats(self):
+        return self._urls.stats()
@@ -0,0 +1,175 @@
+# persistent_cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from common.log import logger
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE INDEX IF NOT EXISTS entries_updated_at ON entries (updated_at);
+"""
+
+
+# 持久化缓存：SQLite（WAL 模式）文件保存在插件目录中，重启后保留，并由同一台机器上的多个进程共享
+# 值以 JSON 保存；读写失败时只记录日志并按未命中处理，不影响正常请求
+class PersistentCache:
+    def __init__(self, path, max_entries=5000, busy_timeout=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self.compactions = 0
+        self._init_schema()
+        self._conn()
+
+    @classmethod
+    def from_config(cls, conf, base_dir):
+        conf = conf or {}
+        return cls(os.path.join(base_dir, conf.get("path", "cache.db")),
+                   max_entries=int(conf.get("max_entries", 5000)))
+
+    # auto_vacuum 必须在开启 WAL 和建表之前设置，否则不生效，compact 也就无法回收空间
+    # 因此建表使用单独的连接；旧版本创建的数据库没有开启 auto_vacuum，用一次 VACUUM 转换
+    def _init_schema(self):
+        conn = sqlite3.connect(
+            self.path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.executescript(_SCHEMA)
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("VACUUM")
+        except sqlite3.Error as e:
+            self._failed("enable auto_vacuum", e)
+        finally:
+            conn.close()
+
+    # 每个线程使用自己的连接
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _failed(self, action, e):
+        self._count("errors")
+        logger.error(f"[whalePlugin] persistent cache {action} failed: {e}")
+
+    def namespace(self, name):
+        return CacheNamespace(self, name)
+
+    # 返回 (value, updated_at, expires_at)，不存在或已过期时返回 None
+    def get(self, namespace, key):
+        self._count("reads")
+        try:
+            row = self._conn().execute(
+                "SELECT value, updated_at, expires_at FROM entries "
+                "WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            self._failed("read", e)
+            return None
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0]), row[1], row[2]
+        except ValueError as e:
+            self._failed("decode", e)
+            return None
+
+    def set(self, namespace, key, value, expires_at=None, updated_at=None):
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"[whalePlugin] persistent cache skipped {namespace}/{key}: {e}")
+            return False
+        self._count("writes")
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, payload, updated_at or time.time(), expires_at))
+        except sqlite3.Error as e:
+            self._failed("write", e)
+            return False
+        return True
+
+    def delete(self, namespace, key=None):
+        try:
+            if key is None:
+                self._conn().execute(
+                    "DELETE FROM entries WHERE namespace = ?", (namespace,))
+            else:
+                self._conn().execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    # 整理：删除过期条目，超过 max_entries 时删除最早写入的条目，回收空闲页并截断 WAL 文件
+    def compact(self):
+        conn = self._conn()
+        try:
+            expired = conn.execute(
+                "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),)).rowcount
+            trimmed = conn.execute(
+                "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries "
+                "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            # 用 execute 执行时 sqlite3 模块只执行一步（只回收一页），需要用 executescript
+            conn.executescript("PRAGMA incremental_vacuum;")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            self._failed("compact", e)
+            return False
+        self._count("compactions")
+        logger.debug(
+            f"[whalePlugin] persistent cache compacted: {expired} expired, {trimmed} trimmed")
+        return True
+
+    def stats(self):
+        try:
+            size = self._conn().execute(
+                "SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        with self._lock:
+            return {"size": size, "max_entries": self.max_entries, "reads": self.reads,
+                    "writes": self.writes, "errors": self.errors, "compactions": self.compactions}
+
+
+# 某个缓存在持久化缓存中的命名空间，供 TTLCache 等内存缓存读穿/写穿使用
+class CacheNamespace:
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+
+    def get(self, key):
+        return self.cache.get(self.name, key)
+
+    def set(self, key, value, expires_at=None, updated_at=None):
+        return self.cache.set(self.name, key, value, expires_at, updated_at)
+
+    def delete(self, key=None):
+        self.cache.delete(self.name, key)
@@ -0,0 +1,155 @@
+# providers.py
+import contextvars
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from common.log import logger
+from deadline import limit_timeout
+
+
+# 一个数据源：request 发起请求返回原始数据，adapter 把原始数据转换为统一结果，无效时返回 None
+class Provider:
+    def __init__(self, name, request, adapter):
+        self.name = name
+        self.request = request
+        self.adapter = adapter
+
+    def fetch(self):
+        return self.adapter(self.request())
+
+
+# 滑动窗口内的延迟统计
+class LatencyTracker:
+    def __init__(self, window=100):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(p * (len(samples) - 1))))
+        return samples[index]
+
+
+# 多数据源路由：按顺序请求各数据源，当前数据源超过其历史延迟分位数仍未返回时，
+# 对下一个数据源发起对冲请求，采用最先返回的有效结果，并记录胜出的数据源
+class ProviderRouter:
+    def __init__(self, hedge_percentile=0.9, default_hedge_delay=1.0, min_hedge_delay=0.2,
+                 max_hedge_delay=3.0, min_samples=10, window=100, timeout=10.0, max_workers=8):
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whale-provider")
+        self._latency = {}
+        self._lock = threading.Lock()
+        self.winners = Counter()
+        self.hedges = Counter()
+
+    @classmethod
+    def from_config(cls, conf):
+        conf = conf or {}
+        return cls(hedge_percentile=float(conf.get("hedge_percentile", 0.9)),
+                   default_hedge_delay=float(
+                       conf.get("default_hedge_delay", 1.0)),
+                   min_hedge_delay=float(conf.get("min_hedge_delay", 0.2)),
+                   max_hedge_delay=float(conf.get("max_hedge_delay", 3.0)),
+                   min_samples=int(conf.get("min_samples", 10)),
+                   timeout=float(conf.get("timeout", 10.0)),
+                   max_workers=int(conf.get("max_workers", 8)))
+
+    def _tracker(self, capability, provider):
+        key = (capability, provider.name)
+        with self._lock:
+            tracker = self._latency.get(key)
+            if tracker is None:
+                tracker = LatencyTracker(self.window)
+                self._latency[key] = tracker
+            return tracker
+
+    def hedge_delay(self, capability, provider):
+        tracker = self._tracker(capability, provider)
+        if len(tracker) < self.min_samples:
+            return self.default_hedge_delay
+        delay = tracker.percentile(self.hedge_percentile)
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, delay))
+
+    def _run(self, capability, provider):
+        start = time.time()
+        try:
+            return provider.fetch()
+        except Exception as e:
+            logger.debug(
+                f"[whalePlugin] provider {capability}/{provider.name} failed: {e}")
+            return None
+        finally:
+            self._tracker(capability, provider).record(time.time() - start)
+
+    # 返回第一个满足 is_valid 的结果；都无效时返回第一个非 None 的结果（如“周末无需摸鱼”），否则返回 None
+    def call(self, capability, providers, is_valid=None):
+        is_valid = is_valid or (lambda value: value is not None)
+        remaining = list(providers)
+        pending = {}
+        fallback = None
+        # 不超过当前指令剩余的时间预算
+        deadline = time.time() + limit_timeout(self.timeout)
+
+        def launch():
+            provider = remaining.pop(0)
+            pending[self._pool.submit(contextvars.copy_context().run,
+                                      self._run, capability, provider)] = provider
+            return provider
+
+        current = launch()
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+            wait_for = deadline - now
+            if remaining:
+                wait_for = min(wait_for, self.hedge_delay(capability, current))
+            done, _ = wait(list(pending), timeout=wait_for,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                if remaining:
+                    self.hedges[capability] += 1
+                    current = launch()
+                    logger.debug(
+                        f"[whalePlugin] hedging {capability} with {current.name}")
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                value = future.result()
+                if value is not None and is_valid(value):
+                    self.winners[(capability, provider.name)] += 1
+                    logger.debug(
+                        f"[whalePlugin] {capability} served by {provider.name}")
+                    return value
+                if fallback is None and value is not None:
+                    fallback = value
+            if not pending and remaining:
+                current = launch()
+        return fallback
+
+    def stats(self):
+        with self._lock:
+            latency = {f"{capability}/{name}": tracker.percentile(0.5)
+                       for (capability, name), tracker in self._latency.items()}
+        return {"winners": {f"{c}/{n}": count for (c, n), count in self.winners.items()},
+                "hedges": dict(self.hedges), "p50": latency}
@@ -0,0 +1,153 @@
+# rate_limit.py
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date
+from urllib.parse import urlparse
+
+import requests
+from common.log import logger
+
+
+class QuotaExceededError(requests.RequestException):
+    pass
+
+
+# 当前消息的发送者和群，由插件在执行指令时设置；线程池中执行时需用 contextvars.copy_context() 传递
+class RequestScope:
+    def __init__(self, user=None, group=None):
+        self.user = user
+        self.group = group
+        self.limited = False
+        # 处理过程中出现过错误（handle_error），回复不能当作有效结果缓存
+        self.failed = False
+
+
+_current_scope = contextvars.ContextVar("whale_request_scope", default=None)
+
+
+@contextmanager
+def request_scope(user=None, group=None):
+    scope = RequestScope(user, group)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope():
+    return _current_scope.get()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, cost=1):
+        self._refill(time.monotonic())
+        return self.tokens >= cost
+
+    def consume(self, cost=1):
+        self.tokens -= cost
+
+
+# 上游额度控制：按用户、按群、按接口的令牌桶，加上每日总额度
+# 任意一个桶不足时直接拒绝请求，调用方返回缓存或降级内容
+class RateLimiter:
+    def __init__(self, daily_budget=None, user=None, group=None, endpoints=None,
+                 hosts=("v2.alapi.cn",), max_keys=10000):
+        self.daily_budget = daily_budget
+        self.user_conf = user
+        self.group_conf = group
+        self.endpoint_conf = dict(endpoints or {})
+        self.hosts = set(hosts)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._day = date.today()
+        self.used_today = 0
+        self.rejected = {}
+
+    @classmethod
+    def from_config(cls, conf):
+        conf = conf or {}
+        return cls(daily_budget=conf.get("daily_budget"),
+                   user=conf.get("user"),
+                   group=conf.get("group"),
+                   endpoints=conf.get("endpoints"),
+                   hosts=conf.get("hosts", ["v2.alapi.cn"]))
+
+    def _bucket(self, key, conf):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(conf.get("rate", 1), conf.get("capacity", 10))
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        scope = current_scope()
+        if scope is not None:
+            scope.limited = True
+        logger.warn(f"[whalePlugin] upstream request rejected: {reason}")
+        raise QuotaExceededError(f"quota exceeded: {reason}")
+
+    @staticmethod
+    def endpoint_of(url):
+        path = urlparse(url).path
+        return path.split("/api/", 1)[-1].strip("/")
+
+    def limits(self, url):
+        return urlparse(url).hostname in self.hosts
+
+    # 请求受控主机前调用，额度不足时抛出 QuotaExceededError
+    def acquire(self, url, cost=1):
+        if not self.limits(url):
+            return
+        scope = current_scope()
+        endpoint = self.endpoint_of(url)
+        with self._lock:
+            today = date.today()
+            if today != self._day:
+                self._day = today
+                self.used_today = 0
+            if self.daily_budget is not None and self.used_today + cost > self.daily_budget:
+                self._reject("daily_budget")
+            buckets = []
+            endpoint_conf = self.endpoint_conf.get(
+                endpoint, self.endpoint_conf.get("default"))
+            if endpoint_conf:
+                buckets.append(
+                    ("endpoint", self._bucket(("endpoint", endpoint), endpoint_conf)))
+            if scope is not None and scope.group and self.group_conf:
+                buckets.append(
+                    ("group", self._bucket(("group", scope.group), self.group_conf)))
+            if scope is not None and scope.user and self.user_conf:
+                buckets.append(
+                    ("user", self._bucket(("user", scope.user), self.user_conf)))
+            for reason, bucket in buckets:
+                if not bucket.available(cost):
+                    self._reject(reason)
+            for _, bucket in buckets:
+                bucket.consume(cost)
+            self.used_today += cost
+
+    def stats(self):
+        with self._lock:
+            return {"used_today": self.used_today, "daily_budget": self.daily_budget,
+                    "rejected": dict(self.rejected)}
@@ -0,0 +1,82 @@
+# router.py
+from functools import partial
+
+_ROUTE = object()
+
+
+class Route:
+    def __init__(self, name, handler, parse=None):
+        self.name = name
+        self.handler = handler
+        self.parse = parse
+
+    def bind(self, content):
+        # parse 返回参数元组，返回 None 表示不匹配
+        if self.parse is None:
+            return partial(self.handler)
+        args = self.parse(content)
+        if args is None:
+            return None
+        return partial(self.handler, *args)
+
+
+# 指令路由：插件初始化时构建一次
+# 完全匹配走哈希表，前缀指令走字典树，后缀指令按后缀长度查表，命中后才执行正则解析
+class CommandRouter:
+    def __init__(self):
+        self._exact = {}
+        self._prefix_trie = {}
+        self._suffixes = {}
+        self._suffix_lengths = []
+
+    def exact(self, keyword, name, handler):
+        self._exact[keyword] = Route(name, handler)
+        return self
+
+    def prefix(self, prefix, name, handler, parse=None):
+        node = self._prefix_trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(_ROUTE, []).append(Route(name, handler, parse))
+        return self
+
+    def suffix(self, suffix, name, handler, parse=None):
+        self._suffixes.setdefault(suffix, []).append(
+            Route(name, handler, parse))
+        if len(suffix) not in self._suffix_lengths:
+            self._suffix_lengths.append(len(suffix))
+            self._suffix_lengths.sort(reverse=True)
+        return self
+
+    def _prefix_routes(self, content):
+        # 沿字典树走到底，最长前缀优先
+        matched = []
+        node = self._prefix_trie
+        for char in content:
+            node = node.get(char)
+            if node is None:
+                break
+            if _ROUTE in node:
+                matched.append(node[_ROUTE])
+        for routes in reversed(matched):
+            yield from routes
+
+    def _suffix_routes(self, content):
+        for length in self._suffix_lengths:
+            if length <= len(content):
+                yield from self._suffixes.get(content[-length:], ())
+
+    # 返回 (指令名, 无参可调用对象)，没有匹配时返回 None
+    def match(self, content):
+        route = self._exact.get(content)
+        if route is not None:
+            return route.name, route.bind(content)
+        for route in self._prefix_routes(content):
+            produce = route.bind(content)
+            if produce is not None:
+                return route.name, produce
+        for route in self._suffix_routes(content):
+            produce = route.bind(content)
+            if produce is not None:
+                return route.name, produce
+        return None
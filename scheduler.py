@@ -0,0 +1,120 @@
+# scheduler.py
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common.log import logger
+
+
+def _parse_time(value):
+    hour, minute = str(value).split(":")
+    return int(hour), int(minute)
+
+
+class Job:
+    def __init__(self, name, task, times=None, interval=None, retries=3, retry_delay=60, jitter=30):
+        self.name = name
+        self.task = task
+        self.times = [_parse_time(t) for t in (times or [])]
+        self.interval = interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.jitter = jitter
+        self.attempt = 0
+        self.next_run = self._next_scheduled(time.time())
+
+    def _next_scheduled(self, now):
+        if self.interval:
+            return now + self.interval
+        current = datetime.fromtimestamp(now)
+        candidates = []
+        for hour, minute in self.times:
+            run_at = current.replace(
+                hour=hour, minute=minute, second=0, microsecond=0)
+            if run_at.timestamp() <= now:
+                run_at += timedelta(days=1)
+            candidates.append(run_at.timestamp())
+        return min(candidates) if candidates else None
+
+    def run(self, now):
+        try:
+            ok = self.task() is not False
+        except Exception as e:
+            logger.error(f"[whalePlugin] scheduled job {self.name} failed: {e}")
+            ok = False
+        if ok or self.attempt >= self.retries:
+            if not ok:
+                logger.warn(
+                    f"[whalePlugin] scheduled job {self.name} gave up after {self.attempt} retries")
+            self.attempt = 0
+            self.next_run = self._next_scheduled(now)
+        else:
+            # 上游尚未更新或请求失败时，按退避时间加随机抖动重试，避免多个实例同时打到上游
+            self.attempt += 1
+            self.next_run = now + self.retry_delay * self.attempt + \
+                random.uniform(0, self.jitter)
+            logger.debug(
+                f"[whalePlugin] scheduled job {self.name} retry #{self.attempt}")
+
+
+# 后台调度线程：按每日固定时间点或固定间隔执行预热任务
+class Scheduler:
+    def __init__(self):
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def add_daily(self, name, times, task, **kwargs):
+        return self._add(Job(name, task, times=times, **kwargs))
+
+    def add_interval(self, name, interval, task, **kwargs):
+        return self._add(Job(name, task, interval=interval, **kwargs))
+
+    def _add(self, job):
+        with self._lock:
+            self._jobs.append(job)
+        self._wakeup.set()
+        return job
+
+    def run_now(self, name):
+        with self._lock:
+            for job in self._jobs:
+                if job.name == name:
+                    job.next_run = time.time()
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._loop, name="whale-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.time()
+            with self._lock:
+                due = [job for job in self._jobs
+                       if job.next_run is not None and job.next_run <= now]
+                upcoming = [job.next_run for job in self._jobs
+                            if job.next_run is not None and job.next_run > now]
+            for job in due:
+                if self._stop.is_set():
+                    return
+                job.run(time.time())
+            if due:
+                continue
+            timeout = min(upcoming) - now if upcoming else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
@@ -0,0 +1,84 @@
+# singleflight.py
+import json
+import threading
+import time
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# 合并相同的并发请求：同一个 key 同时只有一个请求真正发出，其余调用方等待并共享结果或异常
+# private_errors 为只属于发起者本身的异常（如该指令的预算用完、该用户额度不足），不传递给跟随者，跟随者改为自己发起请求
+class SingleFlight:
+    def __init__(self, private_errors=()):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.private_errors = tuple(private_errors)
+        self.shared = 0
+        self.retried = 0
+
+    # timeout 只限制跟随者的等待时间，超时抛出 TimeoutError，不影响正在进行的请求
+    def do(self, key, fn, timeout=None):
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    self.shared += 1
+                    leader = False
+                else:
+                    call = _Call()
+                    self._calls[key] = call
+                    leader = True
+            if leader:
+                break
+
+            remaining = None if expires_at is None else max(
+                0.0, expires_at - time.monotonic())
+            if not call.event.wait(remaining):
+                raise TimeoutError(f"timed out waiting for in-flight {key}")
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.private_errors):
+                raise call.error
+            with self._lock:
+                self.retried += 1
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+def _normalize(value):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+# 按 (方法, 地址, 归一化后的参数) 生成请求 key
+def request_key(method, url, headers=None, params=None, data=None, json_data=None):
+    return (method.upper(), url, _normalize(params), _normalize(data),
+            _normalize(json_data), _normalize(headers))
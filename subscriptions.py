@@ -0,0 +1,135 @@
+# subscriptions.py
+import json
+import os
+import threading
+import time
+
+from bridge.context import Context, ContextType
+from common.log import logger
+from metrics import BROADCAST_TOTAL
+
+
+# 订阅列表：topic -> {key: {"receiver": str, "isgroup": bool, "name": str}}
+# key 为订阅者的稳定标识（微信通道为群名/昵称），receiver 为最近一次可用的会话 ID，推送前可能重新查找
+# 每次修改后原子写回文件，重启后保留
+class SubscriptionStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._topics = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._topics = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"[whalePlugin] failed to load subscriptions: {e}")
+        # 旧版本以 receiver 为 key，没有单独保存 receiver
+        for subscribers in self._topics.values():
+            for key, info in subscribers.items():
+                info.setdefault("receiver", key)
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._topics, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    # 返回 False 表示已经订阅过（此时更新保存的会话 ID）
+    def subscribe(self, topic, key, receiver, isgroup, name=None):
+        with self._lock:
+            subscribers = self._topics.setdefault(topic, {})
+            if key in subscribers:
+                if subscribers[key]["receiver"] != receiver:
+                    subscribers[key]["receiver"] = receiver
+                    self._save()
+                return False
+            subscribers[key] = {"receiver": receiver,
+                                "isgroup": isgroup, "name": name}
+            self._save()
+            return True
+
+    # 返回 False 表示并未订阅
+    def unsubscribe(self, topic, key):
+        with self._lock:
+            if self._topics.get(topic, {}).pop(key, None) is None:
+                return False
+            self._save()
+            return True
+
+    # 按 key_of(info) 重新计算所有订阅者的 key，用于迁移旧版本以会话 ID 为 key 的记录
+    def rekey(self, key_of):
+        with self._lock:
+            changed = False
+            for topic, subscribers in self._topics.items():
+                rekeyed = {key_of(info): info for info in subscribers.values()}
+                if list(rekeyed) != list(subscribers):
+                    self._topics[topic] = rekeyed
+                    changed = True
+            if changed:
+                self._save()
+
+    # 重新查找到的会话 ID 写回所有主题
+    def update_receiver(self, key, receiver):
+        with self._lock:
+            changed = False
+            for subscribers in self._topics.values():
+                info = subscribers.get(key)
+                if info is not None and info["receiver"] != receiver:
+                    info["receiver"] = receiver
+                    changed = True
+            if changed:
+                self._save()
+
+    def topics_of(self, key):
+        with self._lock:
+            return sorted(topic for topic, subscribers in self._topics.items()
+                          if key in subscribers)
+
+    # 返回 [(key, info)]，info 为副本
+    def subscribers(self, topic):
+        with self._lock:
+            return [(key, dict(info)) for key, info in self._topics.get(topic, {}).items()]
+
+    def stats(self):
+        with self._lock:
+            return {topic: len(subscribers) for topic, subscribers in self._topics.items()}
+
+
+# 分批推送同一条回复：批内每条间隔 send_interval 秒，每 batch_size 条后暂停 batch_interval 秒，避免触发通道的发送频率限制
+class Broadcaster:
+    def __init__(self, batch_size=10, send_interval=0.5, batch_interval=5.0):
+        self.batch_size = max(1, batch_size)
+        self.send_interval = send_interval
+        self.batch_interval = batch_interval
+
+    @classmethod
+    def from_config(cls, conf):
+        conf = conf or {}
+        return cls(batch_size=int(conf.get("batch_size", 10)),
+                   send_interval=float(conf.get("send_interval", 0.5)),
+                   batch_interval=float(conf.get("batch_interval", 5.0)))
+
+    def broadcast(self, topic, reply, subscribers, channel):
+        sent = failed = 0
+        for index, (receiver, info) in enumerate(subscribers):
+            if index:
+                time.sleep(self.batch_interval if index %
+                           self.batch_size == 0 else self.send_interval)
+            context = Context(ContextType.TEXT, topic, kwargs={
+                "receiver": receiver, "isgroup": info.get("isgroup", False)})
+            # 本地文件回复在多次发送之间共用同一个文件对象
+            if hasattr(reply.content, "seek"):
+                reply.content.seek(0)
+            try:
+                channel.send(reply, context)
+                sent += 1
+                BROADCAST_TOTAL.inc(topic=topic, outcome="ok")
+            except Exception as e:
+                failed += 1
+                BROADCAST_TOTAL.inc(topic=topic, outcome="error")
+                logger.error(
+                    f"[whalePlugin] broadcast {topic} to {info.get('name') or receiver} failed: {e}")
+        logger.info(
+            f"[whalePlugin] broadcast {topic} finished: {sent} sent, {failed} failed")
+        return sent, failed
@@ -0,0 +1,50 @@
+# http_stub.py
+# 单元测试用的本地 HTTP 服务：按设定的延迟和状态码回复，并统计请求次数
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class HttpStub:
+    def __init__(self, delay=0.0, status=200, body=b"{}"):
+        self.delay = delay
+        self.status = status
+        self.body = body
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/test"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.hits += 1
+                time.sleep(stub.delay)
+                try:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(stub.body)))
+                    self.end_headers()
+                    self.wfile.write(stub.body)
+                except OSError:
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,93 @@
+# test_breaker.py
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python -m unittest discover -s plugins/whalePlugin/tests
+import os
+import sys
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker  # noqa: E402
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def make_breaker(self, **options):
+        conf = {"failure_threshold": 3, "open_duration": 0.05,
+                "half_open_max_calls": 1, "success_threshold": 2}
+        conf.update(options)
+        return CircuitBreaker("example.com", **conf)
+
+    def trip(self, breaker):
+        for _ in range(breaker.failure_threshold):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = self.make_breaker()
+        breaker.record_failure()
+        breaker.record_success(0.1)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.trips, 1)
+
+    def test_opens_on_error_rate(self):
+        breaker = self.make_breaker(failure_threshold=100, window=10, min_calls=4,
+                                    error_rate=0.5)
+        for ok in (True, False, True, False):
+            breaker.record_success(0.1) if ok else breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = self.make_breaker(slow_call_threshold=1.0)
+        for _ in range(3):
+            breaker.record_success(2.0)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_half_open_probes_then_closes(self):
+        breaker = self.make_breaker()
+        self.trip(breaker)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # 同时只放行 half_open_max_calls 个探测请求
+        self.assertFalse(breaker.allow())
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_half_open_failure_reopens(self):
+        breaker = self.make_breaker()
+        self.trip(breaker)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.trips, 2)
+
+    # 探测请求没有结果（如被预算截断）时归还名额，不影响状态
+    def test_release_returns_the_probe_slot(self):
+        breaker = self.make_breaker()
+        self.trip(breaker)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
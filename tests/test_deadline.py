@@ -0,0 +1,79 @@
+# test_deadline.py
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python -m unittest discover -s plugins/whalePlugin/tests
+import os
+import sys
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR, TESTS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from deadline import Deadline, DeadlineExceededError, deadline_scope, limit_timeout  # noqa: E402
+from http_client import HttpClient  # noqa: E402
+from http_stub import HttpStub  # noqa: E402
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_clamp_limits_timeouts_to_remaining_budget(self):
+        deadline = Deadline(1.0)
+        timeout, clamped = deadline.clamp((3.05, 8))
+        self.assertTrue(clamped)
+        self.assertLessEqual(max(timeout), 1.0)
+        timeout, clamped = Deadline(30).clamp((3.05, 8))
+        self.assertEqual(timeout, (3.05, 8))
+        self.assertFalse(clamped)
+
+    def test_limit_timeout_outside_a_command(self):
+        self.assertEqual(limit_timeout(5), 5)
+        with deadline_scope(Deadline(1.0)):
+            self.assertLessEqual(limit_timeout(5), 1.0)
+
+
+class ClampedRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = HttpStub(delay=0.6)
+        self.client = HttpClient(max_retries=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    # 被预算截断的 GET 超时：标记预算用完，不算上游故障
+    def test_clamped_get_sets_exceeded_without_tripping_breaker(self):
+        deadline = Deadline(0.3)
+        with deadline_scope(deadline):
+            with self.assertRaises(DeadlineExceededError):
+                self.client.request("GET", self.stub.url)
+        self.assertTrue(deadline.exceeded)
+        stats = self.client.breakers.get("127.0.0.1").stats()
+        self.assertEqual(stats["error_rate"], 0.0)
+        self.assertEqual(stats["state"], "closed")
+
+    def test_expired_deadline_sends_no_request(self):
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+        with deadline_scope(deadline):
+            with self.assertRaises(DeadlineExceededError):
+                self.client.request("GET", self.stub.url)
+        self.assertTrue(deadline.exceeded)
+        self.assertEqual(self.stub.hits, 0)
+
+    # 预算只够一次尝试时不重试
+    def test_retries_fit_in_the_remaining_budget(self):
+        self.stub.delay = 0
+        self.stub.status = 503
+        with deadline_scope(Deadline(1.0)):
+            self.client.request("GET", self.stub.url, timeout=(0.6, 0.6))
+        self.assertEqual(self.stub.hits, 1)
+        with deadline_scope(Deadline(30)):
+            self.client.request("GET", self.stub.url, timeout=(0.6, 0.6))
+        self.assertEqual(self.stub.hits, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
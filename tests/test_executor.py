@@ -0,0 +1,89 @@
+# test_executor.py
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python -m unittest discover -s plugins/whalePlugin/tests
+import os
+import sys
+import threading
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from executor import CommandExecutor  # noqa: E402
+
+
+class CommandExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.results = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def task(self, value, delay=0.05):
+        def run():
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            time.sleep(delay)
+            with self.lock:
+                self.running -= 1
+            return value
+        return run
+
+    def collect(self, expected):
+        def callback(result):
+            with self.lock:
+                self.results.append(result)
+                if len(self.results) == expected:
+                    self.done.set()
+        return callback
+
+    # 同一指令超过并发上限时排队执行，而不是回复繁忙
+    def test_burst_over_command_limit_is_queued(self):
+        self.executor = CommandExecutor(
+            max_workers=4, max_queue=28, default_command_limit=2)
+        callback = self.collect(10)
+        accepted = [self.executor.submit("早报", self.task(i), callback)
+                    for i in range(10)]
+        self.assertTrue(all(accepted))
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(sorted(self.results), list(range(10)))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(self.executor.pending, 0)
+        self.assertEqual(self.executor.queue_wait(), 0.0)
+
+    # 等待并发名额的任务不占用工作线程，其它指令照常执行
+    def test_limited_command_does_not_block_others(self):
+        self.executor = CommandExecutor(
+            max_workers=2, max_queue=10, command_limits={"搜索音乐": 1})
+        release = threading.Event()
+        for _ in range(3):
+            self.executor.submit("搜索音乐", release.wait, lambda _: None)
+        other = threading.Event()
+        self.assertTrue(self.executor.submit(
+            "早报", lambda: "ok", lambda _: other.set()))
+        self.assertTrue(other.wait(1))
+        release.set()
+
+    def test_rejects_when_queue_is_full(self):
+        self.executor = CommandExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        self.assertTrue(self.executor.submit("早报", release.wait, lambda _: None))
+        self.assertTrue(self.executor.submit("摸鱼", release.wait, lambda _: None))
+        self.assertFalse(self.executor.submit("八卦", release.wait, lambda _: None))
+        time.sleep(0.05)
+        self.assertGreater(self.executor.queue_wait(), 0.0)
+        release.set()
+
+
+if __name__ == "__main__":
+    unittest.main()
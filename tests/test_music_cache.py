@@ -0,0 +1,54 @@
+# test_music_cache.py
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python -m unittest discover -s plugins/whalePlugin/tests
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from music_cache import MusicCache, url_expires_at  # noqa: E402
+
+BEIJING = timezone(timedelta(hours=8))
+
+
+# 网易云 CDN 路径中的时间为北京时间，服务器时区为 UTC（容器默认）时也必须按北京时间解析
+@unittest.skipUnless(hasattr(time, "tzset"), "time.tzset is not available")
+class CdnExpiryUnderUtcTest(unittest.TestCase):
+    def setUp(self):
+        self._tz = os.environ.get("TZ")
+        os.environ["TZ"] = "UTC"
+        time.tzset()
+
+    def tearDown(self):
+        if self._tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = self._tz
+        time.tzset()
+
+    def cdn_url(self, expires_in):
+        stamp = datetime.now(BEIJING) + timedelta(seconds=expires_in)
+        return f"http://m701.music.126.net/{stamp:%Y%m%d%H%M%S}/abc/song.mp3"
+
+    def test_path_stamp_is_beijing_time(self):
+        expires_at = url_expires_at(self.cdn_url(1200))
+        self.assertAlmostEqual(expires_at, time.time() + 1200, delta=2)
+
+    def test_expired_link_is_not_cached(self):
+        cache = MusicCache(refresh_margin=60)
+        cache.put_url("1", self.cdn_url(30))
+        self.assertNotEqual(cache.get_url("1"), self.cdn_url(30))
+        cache.put_url("2", self.cdn_url(1200))
+        self.assertTrue(cache.get_url("2").startswith("http://"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# test_rate_limit.py
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python -m unittest discover -s plugins/whalePlugin/tests
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR, TESTS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from breaker import CircuitOpenError  # noqa: E402
+from http_client import HttpClient  # noqa: E402
+from http_stub import HttpStub  # noqa: E402
+from rate_limit import QuotaExceededError, RateLimiter, request_scope  # noqa: E402
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_user_bucket_rejects_and_marks_scope(self):
+        limiter = RateLimiter(user={"rate": 0, "capacity": 2}, hosts=["api.example.com"])
+        with request_scope("alice") as scope:
+            limiter.acquire("https://api.example.com/api/star")
+            limiter.acquire("https://api.example.com/api/star")
+            with self.assertRaises(QuotaExceededError):
+                limiter.acquire("https://api.example.com/api/star")
+            self.assertTrue(scope.limited)
+        # 其他用户不受影响
+        with request_scope("bob"):
+            limiter.acquire("https://api.example.com/api/star")
+        self.assertEqual(limiter.used_today, 3)
+
+    def test_daily_budget(self):
+        limiter = RateLimiter(daily_budget=1, hosts=["api.example.com"])
+        limiter.acquire("https://api.example.com/api/zaobao")
+        with self.assertRaises(QuotaExceededError):
+            limiter.acquire("https://api.example.com/api/zaobao")
+
+    def test_other_hosts_are_not_limited(self):
+        limiter = RateLimiter(daily_budget=0, hosts=["api.example.com"])
+        limiter.acquire("https://other.example.com/api/zaobao")
+        self.assertEqual(limiter.used_today, 0)
+
+
+class LimiterAndBreakerOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = HttpStub(status=500)
+        self.client = HttpClient(max_retries=2, backoff_factor=0)
+        self.client.limiter = RateLimiter(daily_budget=100, hosts=["127.0.0.1"])
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    # 熔断器打开时直接拒绝，不消耗额度
+    def test_open_breaker_does_not_spend_quota(self):
+        self.client.breakers.get("127.0.0.1")._open()
+        for _ in range(5):
+            with self.assertRaises(CircuitOpenError):
+                self.client.request("GET", self.stub.url)
+        self.assertEqual(self.client.limiter.used_today, 0)
+        self.assertEqual(self.stub.hits, 0)
+
+    # 受额度控制的主机不做传输层重试，实际请求次数与计入的额度一致
+    def test_limited_hosts_are_charged_per_attempt(self):
+        response = self.client.request("GET", self.stub.url)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.stub.hits, 1)
+        self.assertEqual(self.client.limiter.used_today, 1)
+
+    def test_unlimited_hosts_still_retry(self):
+        self.client.limiter = RateLimiter(hosts=["api.example.com"])
+        self.client.request("GET", self.stub.url)
+        self.assertEqual(self.stub.hits, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# test_singleflight.py
+# 在 chatgpt-on-wechat 根目录下运行：
+#   python -m unittest discover -s plugins/whalePlugin/tests
+import os
+import sys
+import threading
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+COW_ROOT = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+for path in (COW_ROOT, PLUGIN_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from singleflight import SingleFlight  # noqa: E402
+
+
+class PrivateError(Exception):
+    pass
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class SingleFlightTest(unittest.TestCase):
+    # 先启动发起者，等它进入 fn 后再启动跟随者
+    def run_leader(self, flight, fn):
+        started = threading.Event()
+        outcome = {}
+
+        def leader_fn():
+            started.set()
+            return fn()
+
+        def leader():
+            try:
+                outcome["result"] = flight.do("key", leader_fn)
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        started.wait(1)
+        return thread, outcome
+
+    def slow(self, value=None, error=None, delay=0.2):
+        def fn():
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return value
+        return fn
+
+    def test_followers_share_the_leader_result(self):
+        flight = SingleFlight()
+        calls = []
+        thread, outcome = self.run_leader(
+            flight, lambda: calls.append(1) or self.slow("data")())
+        self.assertEqual(flight.do("key", lambda: calls.append(1)), "data")
+        thread.join()
+        self.assertEqual(outcome["result"], "data")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.shared, 1)
+
+    def test_upstream_errors_are_shared(self):
+        flight = SingleFlight(private_errors=(PrivateError,))
+        thread, outcome = self.run_leader(
+            flight, self.slow(error=UpstreamError("500")))
+        with self.assertRaises(UpstreamError):
+            flight.do("key", lambda: "unused")
+        thread.join()
+        self.assertIsInstance(outcome["error"], UpstreamError)
+
+    # 发起者自身的预算/额度错误不传递，跟随者自己重新请求
+    def test_private_errors_make_followers_retry(self):
+        flight = SingleFlight(private_errors=(PrivateError,))
+        thread, outcome = self.run_leader(
+            flight, self.slow(error=PrivateError("leader deadline")))
+        self.assertEqual(flight.do("key", lambda: "own", timeout=2), "own")
+        thread.join()
+        self.assertIsInstance(outcome["error"], PrivateError)
+        self.assertEqual(flight.retried, 1)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_follower_wait_is_bounded_by_timeout(self):
+        flight = SingleFlight()
+        thread, _ = self.run_leader(flight, self.slow("late", delay=0.5))
+        with self.assertRaises(TimeoutError):
+            flight.do("key", lambda: "unused", timeout=0.05)
+        thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# weather_store.py
+import time
+from datetime import datetime
+
+from cache import TTLCache
+
+WEATHER_TODAY = "tianqi"
+WEATHER_SEVEN = "tianqi/seven"
+
+
+# 按 city_id 保存最近一次的实况（tianqi）和七天预报（tianqi/seven）数据
+# 过期时间跟随数据自身的 update_time：上游每 refresh_interval 秒更新一次，过期前的重复查询不再请求接口
+class WeatherStore:
+    def __init__(self, refresh_interval=3600, min_ttl=300, maxsize=512, store=None):
+        self.refresh_interval = refresh_interval
+        self.min_ttl = min_ttl
+        self._cache = TTLCache(
+            maxsize=maxsize, default_ttl=refresh_interval, store=store)
+
+    @classmethod
+    def from_config(cls, conf, store=None):
+        conf = conf or {}
+        return cls(refresh_interval=float(conf.get("refresh_interval", 3600)),
+                   min_ttl=float(conf.get("min_ttl", 300)),
+                   maxsize=int(conf.get("maxsize", 512)),
+                   store=store)
+
+    def _expires_at(self, data):
+        now = time.time()
+        record = data[0] if isinstance(data, list) and data else data
+        update_time = record.get("update_time") if isinstance(
+            record, dict) else None
+        try:
+            updated = datetime.strptime(
+                update_time, "%Y-%m-%d %H:%M:%S").timestamp()
+        except (TypeError, ValueError):
+            updated = now
+        return max(updated + self.refresh_interval, now + self.min_ttl)
+
+    def get(self, city_id, kind):
+        if not city_id:
+            return None
+        return self._cache.get((str(city_id), kind))
+
+    def put(self, city_id, kind, data):
+        if not city_id:
+            return
+        self._cache.set((str(city_id), kind), data,
+                        expires_at=self._expires_at(data))
+
+    def evict(self, city_id=None):
+        if city_id is None:
+            self._cache.clear()
+            return
+        for kind in (WEATHER_TODAY, WEATHER_SEVEN):
+            self._cache.evict((str(city_id), kind))
+
+    def stats(self):
+        return self._cache.stats()
@@ -2,6 +2,7 @@ import plugins
 import requests
 import re
 import json
+import io
 from urllib.parse import urlparse
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
@@ -10,6 +11,28 @@ from common.log import logger
 from plugins import *
 from datetime import datetime, timedelta
 from functions import *
+from http_client import configure_http_client, http_client
+from config import conf, global_config
+from cache import DailyCache, NegativeCache, StaleWhileRevalidateCache
+from executor import CommandExecutor
+from router import CommandRouter
+from scheduler import Scheduler
+from city_index import CityIndex
+from weather_store import WeatherStore
+from persistent_cache import PersistentCache
+from media_cache import MediaCache, configure_url_validator, url_validator
+from providers import ProviderRouter
+from horoscope_store import HoroscopeStore
+from music_cache import MusicCache
+from rate_limit import RateLimiter, current_scope, request_scope
+from deadline import Deadline, current_deadline, deadline_scope
+from admission import DEGRADE, REJECT, AdmissionController
+from subscriptions import Broadcaster, SubscriptionStore
+from metrics import metrics, MetricsServer, COMMAND_TOTAL, COMMAND_LATENCY, UPSTREAM_TOTAL, UPSTREAM_LATENCY
+import time
+import os
+import threading
+from functools import partial
 
 
 @plugins.register(
@@ -25,6 +48,28 @@ class whalePlugin(Plugin):
         super().__init__()
         self.alapi_token = None
         self.morning_news_text_enabled = False
+        self.persistent_cache = None
+        self.daily_cache = DailyCache()
+        self.negative_cache = NegativeCache()
+        self.music_search_options = {}
+        self.music_cache = MusicCache()
+        self.deadline_conf = {}
+        self.executor = None
+        self.admission = None
+        self.hot_trends_limit = 15
+        self.hot_trends_cache = self._build_hot_trends_cache({})
+        self.scheduler = Scheduler()
+        self.metrics_server = None
+        self.media_cache = None
+        self.subscriptions = None
+        self.broadcaster = None
+        self.channel = None
+        self.city_index = self._load_city_index()
+        self.weather_store = WeatherStore()
+        self.provider_router = ProviderRouter()
+        self.horoscope_store = self._build_horoscope_store({})
+        self.router = self._build_router()
+        self._register_cache_metrics()
         try:
             self.conf = super().load_config()
             if not self.conf:
@@ -36,129 +81,763 @@ class whalePlugin(Plugin):
                 self.alapi_token = self.conf.get("alapi_token")
                 self.morning_news_text_enabled = self.conf.get(
                     "morning_news_text_enabled", False)
+                configure_http_client(self.conf.get("http"))
+                configure_url_validator(self.conf.get("url_validation"))
+                media_cache_conf = self.conf.get("media_cache", {})
+                if media_cache_conf.get("enabled"):
+                    self.media_cache = MediaCache.from_config(
+                        media_cache_conf, os.path.dirname(__file__))
+                rate_limit_conf = self.conf.get("rate_limit", {})
+                if rate_limit_conf.get("enabled"):
+                    http_client.limiter = RateLimiter.from_config(
+                        rate_limit_conf)
+                persistent_conf = self.conf.get("persistent_cache", {})
+                if persistent_conf.get("enabled"):
+                    self._enable_persistent_cache(persistent_conf)
+                self.daily_cache = DailyCache.from_config(
+                    self.conf.get("daily_cache"), store=self._store("daily"))
+                self.negative_cache = NegativeCache.from_config(
+                    self.conf.get("negative_cache"))
+                self.music_search_options = dict(
+                    self.conf.get("music_search", {}))
+                self.music_cache = MusicCache.from_config(
+                    self.music_search_options.pop("cache", None))
+                self.deadline_conf = self.conf.get("deadline", {})
+                executor_conf = self.conf.get("executor", {})
+                if executor_conf.get("enabled"):
+                    self.executor = CommandExecutor.from_config(executor_conf)
+                admission_conf = self.conf.get("admission", {})
+                if admission_conf.get("enabled"):
+                    self.admission = AdmissionController.from_config(
+                        admission_conf, lambda: http_client.in_flight,
+                        lambda: self.executor.queue_wait() if self.executor else None)
+                self.provider_router = ProviderRouter.from_config(
+                    self.conf.get("providers"))
+                self.horoscope_store = self._build_horoscope_store(
+                    self.conf.get("horoscope"))
+                self.weather_store = WeatherStore.from_config(
+                    self.conf.get("weather_store"), store=self._store("weather"))
+                hot_trends_conf = self.conf.get("hot_trends", {})
+                self.hot_trends_limit = int(hot_trends_conf.get("limit", 15))
+                self.hot_trends_cache = self._build_hot_trends_cache(
+                    hot_trends_conf)
+                prewarm_conf = self.conf.get("prewarm", {})
+                if prewarm_conf.get("enabled"):
+                    self._schedule_prewarm(prewarm_conf)
+                broadcast_conf = self.conf.get("broadcast", {})
+                if broadcast_conf.get("enabled"):
+                    self._schedule_broadcast(broadcast_conf)
+                self._start_metrics_export(self.conf.get("metrics", {}))
+                if len(self.scheduler):
+                    self.scheduler.start()
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
         except Exception as e:
             handle_error(e, "[whalePlugin] Initialization failed, ignoring.")
 
+    # 预热：在用户请求之前把高频内容拉取到缓存中
+    def _schedule_prewarm(self, conf):
+        retry_options = {
+            "retries": int(conf.get("retries", 3)),
+            "retry_delay": float(conf.get("retry_delay", 60)),
+            "jitter": float(conf.get("jitter", 30)),
+        }
+        scheduler = self.scheduler
+        daily_jobs = [
+            ("早报", conf.get("morning_news"), self._load_morning_news),
+            ("摸鱼", conf.get("moyu"), self._load_moyu_calendar),
+            ("每日一题", conf.get("daily_question"), self._load_daily_question),
+            ("八卦", conf.get("bagua"), self._load_mx_bagua),
+        ]
+        for name, times, load in daily_jobs:
+            if times:
+                scheduler.add_daily(
+                    name, times, partial(self._prewarm_daily, name, load), **retry_options)
+        if conf.get("horoscope"):
+            scheduler.add_daily(
+                "星座", conf["horoscope"], lambda: self.horoscope_store.refresh(), **retry_options)
+        for hot_trends_type in conf.get("hot_trends", []):
+            if hot_trends_type in hot_trend_types:
+                # 默认按热榜缓存中该平台的刷新间隔定时刷新
+                interval = conf.get(
+                    "hot_trends_interval") or self.hot_trends_cache.interval_for(hot_trends_type)
+                scheduler.add_interval(
+                    f"{hot_trends_type}热榜", float(interval),
+                    partial(self._prewarm_hot_trends, hot_trends_type), **retry_options)
+
+    # 订阅推送：每个内容每天只拉取、渲染一次，再分批发送给所有订阅的群和用户
+    def _schedule_broadcast(self, conf):
+        self.subscriptions = SubscriptionStore(os.path.join(
+            os.path.dirname(__file__), conf.get("file", "subscriptions.json")))
+        self.subscriptions.rekey(lambda info: self._subscriber_key(
+            info["receiver"], info.get("isgroup", False), info.get("name")))
+        self.broadcaster = Broadcaster.from_config(conf)
+        retry_options = {
+            "retries": int(conf.get("retries", 3)),
+            "retry_delay": float(conf.get("retry_delay", 60)),
+            "jitter": float(conf.get("jitter", 30)),
+        }
+        for topic, times in (conf.get("times") or {}).items():
+            if topic in BROADCAST_TOPICS and times:
+                self.scheduler.add_daily(
+                    f"推送{topic}", times, partial(self._broadcast, topic), **retry_options)
+
+    def _broadcast(self, topic):
+        load, render = {
+            "早报": (self._load_morning_news, self._morning_news),
+            "摸鱼": (self._load_moyu_calendar, self._moyu_calendar),
+            "每日一题": (self._load_daily_question, self._daily_question),
+        }[topic]
+        load()
+        if self.daily_cache.get(topic) is None:
+            # 上游尚未更新或请求失败，由调度器稍后重试
+            return False
+        subscribers = self._resolve_subscribers(topic)
+        if not subscribers:
+            return True
+        reply = self._localize(render())
+        # 分批发送耗时较长，放到单独的线程中，避免阻塞其它定时任务
+        threading.Thread(target=self.broadcaster.broadcast,
+                         args=(topic, reply, subscribers,
+                               self._broadcast_channel()),
+                         name="whale-broadcast", daemon=True).start()
+        return True
+
+    # 推送前重新确认每个订阅者的会话 ID，找不到的订阅者从该主题中移除，返回 [(receiver, info)]
+    def _resolve_subscribers(self, topic):
+        resolved = []
+        for key, info in self.subscriptions.subscribers(topic):
+            try:
+                receiver = self._resolve_receiver(info)
+            except Exception as e:
+                # 通道暂时不可用时按保存的会话 ID 发送
+                logger.warn(f"[whalePlugin] resolve subscriber {key} failed: {e}")
+                receiver = info["receiver"]
+            if receiver is None:
+                logger.warn(
+                    f"[whalePlugin] subscriber {info.get('name') or key} not found, unsubscribe {topic}")
+                self.subscriptions.unsubscribe(topic, key)
+                continue
+            if receiver != info["receiver"]:
+                self.subscriptions.update_receiver(key, receiver)
+            resolved.append((receiver, info))
+        return resolved
+
+    # 微信（itchat）通道的 UserName 只在本次登录内有效，重新登录后按保存的群名/昵称重新查找，找不到或有重名时返回 None
+    # 其它通道的会话 ID 是稳定的，直接使用
+    def _resolve_receiver(self, info):
+        if conf().get("channel_type", "wx") != "wx":
+            return info["receiver"]
+        from lib import itchat
+        search = itchat.search_chatrooms if info.get(
+            "isgroup") else itchat.search_friends
+        if search(userName=info["receiver"]):
+            return info["receiver"]
+        name = info.get("name")
+        if not name:
+            return None
+        matches = [contact["UserName"] for contact in search(name=name) or []
+                   if name in (contact.get("NickName"), contact.get("RemarkName"))]
+        return matches[0] if len(matches) == 1 else None
+
+    # 订阅者的稳定标识：微信通道按群名/昵称（会话 ID 重新登录后会变），其它通道按会话 ID
+    def _subscriber_key(self, receiver, isgroup, name):
+        if conf().get("channel_type", "wx") == "wx" and name:
+            return f"{'group' if isgroup else 'user'}:{name}"
+        return receiver
+
+    def _context_subscriber_key(self, context):
+        return self._subscriber_key(context["receiver"], context.get("isgroup", False),
+                                    getattr(context.get("msg"), "other_user_nickname", None))
+
+    # 优先使用收到订阅指令时的通道，重启后尚未收到消息时按配置创建
+    def _broadcast_channel(self):
+        if self.channel is None:
+            from channel.channel_factory import create_channel
+            self.channel = create_channel(conf().get("channel_type", "wx"))
+        return self.channel
+
+    # 持久化缓存：重启后缓存不丢失，多个进程共享同一份数据
+    def _enable_persistent_cache(self, conf):
+        try:
+            self.persistent_cache = PersistentCache.from_config(
+                conf, os.path.dirname(__file__))
+        except Exception as e:
+            handle_error(e, "[whalePlugin] persistent cache unavailable")
+            return
+        metrics.register_cache("persistent", self.persistent_cache.stats)
+        self.scheduler.add_interval(
+            "持久化缓存整理", float(conf.get("compact_interval", 3600)),
+            self.persistent_cache.compact)
+
+    def _store(self, name):
+        if self.persistent_cache is None:
+            return None
+        return self.persistent_cache.namespace(name)
+
+    # 各缓存的命中统计，供 #whalestats 和 Prometheus 导出使用
+    def _register_cache_metrics(self):
+        metrics.register_cache("daily", lambda: self.daily_cache.stats())
+        metrics.register_cache(
+            "hot_trends", lambda: self.hot_trends_cache.stats())
+        metrics.register_cache("weather", lambda: self.weather_store.stats())
+        metrics.register_cache("music_search", lambda: self.music_cache.stats())
+        metrics.register_cache(
+            "music_urls", lambda: self.music_cache.url_stats())
+        metrics.register_cache(
+            "negative", lambda: self.negative_cache.stats())
+        metrics.register_cache(
+            "horoscope", lambda: self.horoscope_store.stats())
+        metrics.register_cache("url_validation", url_validator.stats)
+        metrics.register_cache(
+            "media", lambda: self.media_cache.stats() if self.media_cache else {})
+
+    # 指标导出：本地 HTTP 端点和/或定期写出 Prometheus 文本文件
+    def _start_metrics_export(self, conf):
+        if conf.get("http_port"):
+            try:
+                self.metrics_server = MetricsServer(
+                    metrics, conf.get("http_host", "127.0.0.1"), int(conf["http_port"])).start()
+            except OSError as e:
+                handle_error(e, "[whalePlugin] metrics endpoint failed to start")
+        if conf.get("textfile"):
+            self.scheduler.add_interval(
+                "metrics", float(conf.get("textfile_interval", 60)),
+                partial(metrics.write_textfile, conf["textfile"]))
+
+    def _prewarm_daily(self, name, load):
+        content = load()
+        if self.media_cache is not None and isinstance(content, str) and is_valid_url(content):
+            self.media_cache.fetch(content)
+        return self.daily_cache.get(name) is not None
+
+    def _prewarm_hot_trends(self, hot_trends_type):
+        # 直接拉取最新热榜，失败时保留旧数据
+        return self.hot_trends_cache.refresh(hot_trends_type)
+
+    # 星座缓存：每天批量拉取全部星座，保存渲染好的回复
+    def _build_horoscope_store(self, conf):
+        return HoroscopeStore.from_config(
+            conf, self._fetch_horoscope, ZODIAC_MAPPING, store=self._store("horoscope"))
+
+    def _fetch_horoscope(self, zodiac):
+        return self.provider_router.call(
+            "星座", horoscope_providers(self.alapi_token, ZODIAC_MAPPING[zodiac]))
+
+    # 热榜缓存：只保存渲染好的前 N 条，过期后先返回旧数据并在后台刷新
+    def _build_hot_trends_cache(self, conf):
+        return StaleWhileRevalidateCache(
+            self._fetch_hot_trends,
+            refresh_interval=float(conf.get("refresh_interval", 300)),
+            intervals=conf.get("intervals"),
+            max_stale=float(conf.get("max_stale", 3600)),
+            should_cache=lambda info: info.startswith("更新时间"),
+            store=self._store("hot_trends"))
+
+    # 加载重名城市数据，构建城市索引
+    def _load_city_index(self):
+        conditions = load_city_conditions(os.path.join(
+            os.path.dirname(__file__), "duplicate-citys.json"))
+        if not isinstance(conditions, dict):
+            return CityIndex()
+        city_index = CityIndex.from_conditions(conditions)
+        logger.info(
+            f"[whalePlugin] city index loaded with {len(city_index)} cities.")
+        return city_index
+
+    # 注册指令路由，只在初始化时构建一次
+    def _build_router(self):
+        router = CommandRouter()
+        router.exact("#whalebreakers", "#whalebreakers", self._breaker_status)
+        router.exact("#whalestats", "#whalestats", self._stats)
+        router.exact("早报", "早报", self._morning_news)
+        router.exact("摸鱼", "摸鱼", self._moyu_calendar)
+        router.exact("每日一题", "每日一题", self._daily_question)
+        router.exact("摸鱼视频", "摸鱼视频", self._moyu_calendar_video)
+        router.exact("八卦", "八卦", self._mx_bagua)
+        router.exact("查看订阅", "订阅", self._list_subscriptions)
+        for topic in BROADCAST_TOPICS:
+            router.exact(f"订阅{topic}", "订阅",
+                         partial(self._subscribe, topic))
+            router.exact(f"取消订阅{topic}", "订阅",
+                         partial(self._unsubscribe, topic))
+        for zodiac in ZODIAC_MAPPING:
+            router.exact(zodiac, "星座", partial(self._horoscope, zodiac))
+        router.prefix("搜索音乐 ", "搜索音乐", self._music_search,
+                      parse=lambda content: (content[len("搜索音乐 "):].strip(),))
+        router.suffix("座", "星座", self._horoscope, parse=_parse_horoscope)
+        router.suffix("热榜", "热榜", self._hot_trends, parse=_parse_hot_trends)
+        router.suffix("天气", "天气", self._weather,
+                      parse=partial(_parse_weather, city_index=self.city_index))
+        return router
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type != ContextType.TEXT:
             return
         content = e_context["context"].content.strip()
         logger.debug(f"[whalePlugin] on_handle_context. Content: {content}")
 
-        # 早报功能
-        if content == "早报":
-            news = get_morning_news(
-                self.alapi_token, self.morning_news_text_enabled)
-            reply_type = ReplyType.IMAGE_URL if is_valid_url(
-                news) else ReplyType.TEXT
-            reply = create_reply(reply_type, news)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
+        matched = self.router.match(content)
+        if matched is None:
             return
-
-        # 摸鱼日历功能
-        if content == "摸鱼":
-            moyu = get_moyu_calendar()
-            reply_type = ReplyType.IMAGE_URL if is_valid_url(
-                moyu) else ReplyType.TEXT
-            reply = create_reply(reply_type, moyu)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
+        command, produce = matched
+        if command in ADMIN_COMMANDS and not self._is_admin(e_context):
             return
+        if command == "订阅":
+            # 订阅指令需要知道接收者，并记住通道供定时推送使用
+            self.channel = e_context["channel"]
+            produce = partial(produce, context=e_context["context"])
+        if self.admission is not None:
+            decision = self.admission.check(command)
+            if decision in (DEGRADE, REJECT):
+                self._shed(e_context, command, content, decision)
+                return
+            if command in self.admission.cacheable:
+                produce = partial(self._remember_reply, content, produce)
+        self._reply(e_context, command, produce)
 
-        # 每日一题功能
-        if content == "每日一题":
-            title, url = fetch_daily_question()
-            if title and url:
-                reply_content = f"今天的每日一题是：{title}\n题目链接：{url}"
+    # 过载时不再请求上游：可缓存的指令返回最近一次的结果并注明时间，其余直接回复繁忙
+    def _shed(self, e_context, command, content, decision):
+        e_context.action = EventAction.BREAK_PASS
+        last_known = self.admission.last_known(
+            content) if decision == DEGRADE else None
+        reply = None
+        if last_known is not None:
+            reply_type, value, age = last_known
+            if reply_type == ReplyType.TEXT:
+                reply = create_reply(
+                    reply_type, f"{value}\n⏱️ 当前请求较多，以上为 {max(1, int(age // 60))} 分钟前的结果")
             else:
-                reply_content = "无法获取每日一题，请稍后再试。"
-            reply = create_reply(ReplyType.TEXT, reply_content)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
-            return
+                # 图片/视频按来源链接记录，过载时只使用已下载的本地文件，不再下载
+                reply = self._localize(create_reply(
+                    reply_type, value), download=False)
+        if reply is None:
+            COMMAND_TOTAL.inc(command=command, status="shed")
+            reply = create_reply(ReplyType.TEXT, "当前请求较多，请稍后再试")
+        else:
+            COMMAND_TOTAL.inc(command=command, status="degraded")
+        e_context["reply"] = reply
 
-        # 音乐搜索功能
-        if content.startswith("搜索音乐 "):
-            keyword = content[len("搜索音乐 "):].strip()
-            music_results = music_search(
-                self.alapi_token, keyword)  # 调用music_search函数
-            if music_results:
-                # 构建回复内容
-                reply_content = "\n".join(
-                    [f"歌曲：{song['song_name']}\n歌手：{song['artists']}\n时长：{song['duration']}秒\n链接：{song['url']}\n"
-                     for song in music_results]
-                )
-                reply = create_reply(ReplyType.TEXT, reply_content)
-            else:
-                reply = create_reply(ReplyType.TEXT, "未找到相关音乐或发生错误。")
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
-            return
+    # 记录成功的回复，过载时作为降级结果；出错、被限流或超时的回复不记录
+    def _remember_reply(self, key, produce):
+        reply = produce()
+        scope = current_scope()
+        deadline = current_deadline()
+        if (scope is not None and (scope.failed or scope.limited)) or (deadline is not None and deadline.exceeded):
+            return reply
+        # 图片/视频回复在这里仍是来源链接，转换为本地文件在之后的 _localize 中进行
+        if isinstance(reply.content, str):
+            self.admission.remember(key, reply.type, reply.content)
+        return reply
 
-        # 摸鱼视频功能
-        if content == "摸鱼视频":
-            moyu_video = get_moyu_calendar_video()
-            reply_type = ReplyType.VIDEO_URL if is_valid_url(
-                moyu_video) else ReplyType.TEXT
-            reply = create_reply(reply_type, moyu_video)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
-            return
+    # 返回 (发送者, 群)，私聊时群为 None
+    @staticmethod
+    def _sender(context):
+        if context.get("isgroup", False):
+            msg = context["msg"]
+            return msg.actual_user_id, msg.other_user_id
+        return context["receiver"], None
 
-        # 八卦功能
-        if content == "八卦":
-            bagua = get_mx_bagua()
-            reply_type = ReplyType.IMAGE_URL if is_valid_url(
-                bagua) else ReplyType.TEXT
-            reply = create_reply(reply_type, bagua)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
-            return
+    # 与 godcmd 一致：管理员列表保存在 global_config["admin_users"]
+    def _is_admin(self, e_context):
+        user, _ = self._sender(e_context["context"])
+        return user in global_config.get("admin_users", [])
 
-        # 星座运势功能
-        horoscope_match = re.match(r'^([\u4e00-\u9fa5]{2}座)$', content)
-        if horoscope_match:
-            if content in ZODIAC_MAPPING:
-                zodiac_english = ZODIAC_MAPPING[content]
-                horoscope_info = get_horoscope(
-                    self.alapi_token, zodiac_english)
-                reply = create_reply(ReplyType.TEXT, horoscope_info)
-            else:
-                reply = create_reply(ReplyType.TEXT, "请重新输入星座名称")
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
+    # 执行命令并回复：未开启异步时直接在当前线程执行，否则交给执行池，结果通过 channel 异步发送
+    def _reply(self, e_context, command, produce):
+        e_context.action = EventAction.BREAK_PASS
+        user, group = self._sender(e_context["context"])
+        produce = partial(self._run_command, command, user,
+                          group, self._deadline_for(command), produce)
+        if self.executor is None:
+            e_context["reply"] = produce()
             return
+        context = e_context["context"]
+        channel = e_context["channel"]
+        accepted = self.executor.submit(
+            command, produce, partial(self._send_async, channel, context))
+        if not accepted:
+            e_context["reply"] = create_reply(
+                ReplyType.TEXT, "当前请求较多，请稍后再试")
 
-        # 热榜功能
-        hot_trend_match = re.search(r'(.{1,6})热榜$', content)
-        if hot_trend_match:
-            hot_trends_type = hot_trend_match.group(1).strip()
-            hot_trends_info = get_hot_trends(hot_trends_type)
-            reply = create_reply(ReplyType.TEXT, hot_trends_info)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
-            return
+    # 异步回复与通道同步回复走相同的装饰和发送流程（群聊 @ 发送者、回复前缀、ON_DECORATE_REPLY/ON_SEND_REPLY 事件）
+    # 没有这些方法的通道（如压测脚本中的通道）直接发送
+    @staticmethod
+    def _send_async(channel, context, reply):
+        if hasattr(channel, "_decorate_reply") and hasattr(channel, "_send_reply"):
+            channel._send_reply(context, channel._decorate_reply(context, reply))
+        else:
+            channel.send(reply, context)
 
-        # 天气查询功能
-        weather_match = re.match(
-            r'^(?:(.{2,7}?)(?:市|县|区|镇)?|(\d{7,9}))(:?今天|明天|后天|7天|七天)?(?:的)?天气$', content)
-        if weather_match:
-            city_or_id = weather_match.group(1) or weather_match.group(2)
-            date = weather_match.group(3) or "今天"
-            if not self.alapi_token:
-                handle_error("alapi_token not configured",
-                             "Weather request failed.")
-                reply = create_reply(
-                    ReplyType.TEXT, "Please configure the 'alapi_token' first.")
-            else:
-                weather_info = get_weather(self.alapi_token, city_or_id, date)
-                reply = create_reply(ReplyType.TEXT, weather_info)
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS
+    # 每条指令的总耗时预算，从收到消息开始计算（包括在执行池中排队的时间），0 表示不限制
+    def _deadline_for(self, command):
+        budget = self.deadline_conf.get("commands", {}).get(
+            command, self.deadline_conf.get("default", DEFAULT_DEADLINE))
+        return Deadline(float(budget)) if budget else None
+
+    # 在发送者的限流范围和指令的时间预算内执行指令，额度不足或超时时在回复中提示
+    def _run_command(self, command, user, group, deadline, produce):
+        start = time.time()
+        status = "ok"
+        try:
+            with request_scope(user, group) as scope, deadline_scope(deadline):
+                reply = self._localize(produce())
+            if deadline is not None and deadline.exceeded:
+                status = "deadline"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            COMMAND_TOTAL.inc(command=command, status=status)
+            COMMAND_LATENCY.observe(time.time() - start, command=command)
+        if scope.limited and reply.type == ReplyType.TEXT:
+            reply.content += "\n⚠️ 请求过于频繁或今日额度已用完，请稍后再试"
+        if status == "deadline" and reply.type == ReplyType.TEXT:
+            reply.content += "\n⏱️ 请求超时，以上内容可能不完整或来自缓存，请稍后再试"
+        return reply
+
+    # 多数据源请求：对冲慢的数据源，采用最先返回的有效结果
+    def _call_providers(self, capability, providers, failure_message, is_valid=None):
+        result = self.provider_router.call(capability, providers, is_valid)
+        if result is None:
+            return handle_error(f"all providers failed for {capability}", failure_message)
+        return result
+
+    @staticmethod
+    def _is_morning_news(news):
+        return news.startswith("☕") or is_valid_url(news)
+
+    # 早报、摸鱼、八卦、每日一题：按当日缓存获取内容
+    def _load_morning_news(self):
+        return self._load_daily(
+            "早报",
+            partial(self._call_providers, "早报",
+                    morning_news_providers(
+                        self.alapi_token, self.morning_news_text_enabled),
+                    "早报获取失败，请稍后再试"),
+            should_cache=self._is_morning_news)
+
+    def _load_moyu_calendar(self):
+        return self._load_daily(
+            "摸鱼",
+            partial(self._call_providers, "摸鱼",
+                    moyu_calendar_providers(is_valid_image_url),
+                    "暂无可用“摸鱼”服务，认真上班", is_valid=is_valid_url),
+            should_cache=is_valid_url, no_content=MOYU_NO_CONTENT)
+
+    def _load_daily_question(self):
+        return self._load_daily(
+            "每日一题", fetch_daily_question,
+            should_cache=lambda question: all(question))
+
+    def _load_mx_bagua(self):
+        return self._load_daily(
+            "八卦",
+            lambda: get_mx_bagua(make_request, is_valid_image_url),
+            should_cache=is_valid_url, no_content=BAGUA_NO_CONTENT)
+
+    # 每日内容：有效内容按内容日缓存；“今日无内容”和失败结果记入负缓存，过期前不再请求上游
+    def _load_daily(self, name, loader, should_cache, no_content=None):
+        def load():
+            cached = self._negative_hit(name)
+            if cached is not None:
+                return cached
+            value = loader()
+            if no_content is not None and value == no_content:
+                # 只有周末才相信“今日无内容”，工作日出现多半是图片检查失败，按普通错误短暂缓存
+                if self.daily_cache.content_day(name).weekday() >= 5:
+                    self.negative_cache.set(
+                        name, "no_content", value, self.daily_cache.next_cutover(name).timestamp())
+                else:
+                    self._remember_failure(name, value)
+            elif not should_cache(value):
+                self._remember_failure(name, value)
+            return value
+        return self.daily_cache.get_or_load(name, load, should_cache=should_cache)
+
+    # 负缓存命中时标记当前指令失败，避免失败提示被当作有效结果记录
+    def _negative_hit(self, key):
+        value = self.negative_cache.get(key)
+        if value is not None:
+            scope = current_scope()
+            if scope is not None:
+                scope.failed = True
+        return value
+
+    # 记录失败结果；指令超时或被限流属于本次请求自身的问题，不影响其它用户，不记录
+    def _remember_failure(self, key, value):
+        deadline = current_deadline()
+        scope = current_scope()
+        if (deadline is not None and deadline.exceeded) or (scope is not None and scope.limited):
             return
+        self.negative_cache.set(key, "error", value)
+
+    # 图片/视频回复：内容为链接时回复链接，否则为提示文字；链接在 _localize 中转换为本地文件
+    def _media_reply(self, content, reply_type):
+        if not is_valid_url(content):
+            return create_reply(ReplyType.TEXT, content)
+        return create_reply(reply_type, content)
+
+    # 开启本地媒体缓存时把图片/视频链接回复换成本地文件，通道不必为每个群重新下载
+    # download 为 False 时只使用已缓存的文件
+    def _localize(self, reply, download=True):
+        if self.media_cache is None or reply is None or reply.type not in LOCAL_MEDIA_TYPES:
+            return reply
+        url = reply.content
+        path = self.media_cache.fetch(
+            url) if download else self.media_cache.get(url)
+        if path is None:
+            return reply
+        return self._local_media_reply(LOCAL_MEDIA_TYPES[reply.type], path) or reply
+
+    # 把本地媒体文件读入内存后交给通道，通道不会关闭文件对象，直接传打开的文件会泄漏文件描述符
+    def _local_media_reply(self, reply_type, path):
+        try:
+            with open(path, "rb") as f:
+                return create_reply(reply_type, io.BytesIO(f.read()))
+        except OSError as e:
+            logger.warn(f"[whalePlugin] read cached media {path} failed: {e}")
+            return None
+
+    def _morning_news(self):
+        return self._media_reply(self._load_morning_news(), ReplyType.IMAGE_URL)
+
+    def _moyu_calendar(self):
+        return self._media_reply(self._load_moyu_calendar(), ReplyType.IMAGE_URL)
+
+    def _daily_question(self):
+        title, url = self._load_daily_question()
+        if title and url:
+            reply_content = f"今天的每日一题是：{title}\n题目链接：{url}"
+        else:
+            reply_content = "无法获取每日一题，请稍后再试。"
+        return create_reply(ReplyType.TEXT, reply_content)
+
+    def _music_search(self, keyword):
+        music_results = music_search(
+            self.alapi_token, keyword, music_cache=self.music_cache, **self.music_search_options)  # 调用music_search函数
+        if not music_results:
+            return create_reply(ReplyType.TEXT, "未找到相关音乐或发生错误。")
+        # 构建回复内容
+        reply_content = "\n".join(
+            [f"歌曲：{song['song_name']}\n歌手：{song['artists']}\n时长：{song['duration']}秒\n链接：{song['url'] or '解析超时，请稍后重试'}\n"
+             for song in music_results]
+        )
+        pending = sum(1 for song in music_results if not song['url'])
+        if pending:
+            reply_content += f"\n⚠️ 部分结果：{pending} 首歌曲链接未能及时解析"
+        return create_reply(ReplyType.TEXT, reply_content)
+
+    def _moyu_calendar_video(self):
+        moyu_video = self._load_daily(
+            "摸鱼视频",
+            lambda: get_moyu_calendar_video(
+                make_request, is_valid_image_url, logger),
+            should_cache=is_valid_url)
+        return self._media_reply(moyu_video, ReplyType.VIDEO_URL)
+
+    def _mx_bagua(self):
+        return self._media_reply(self._load_mx_bagua(), ReplyType.IMAGE_URL)
+
+    def _horoscope(self, content):
+        if content not in ZODIAC_MAPPING:
+            return create_reply(ReplyType.TEXT, "请重新输入星座名称")
+        horoscope_info = self.horoscope_store.get(content)
+        if horoscope_info is None:
+            horoscope_info = handle_error(
+                f"all providers failed for {content}", "星座信息获取失败，请稍后再试")
+        return create_reply(ReplyType.TEXT, horoscope_info)
+
+    def _subscribe(self, topic, context):
+        if self.subscriptions is None:
+            return create_reply(ReplyType.TEXT, "未开启订阅推送")
+        name = getattr(context.get("msg"), "other_user_nickname", None)
+        if not self.subscriptions.subscribe(topic, self._context_subscriber_key(context), context["receiver"],
+                                            context.get("isgroup", False), name):
+            return create_reply(ReplyType.TEXT, f"已经订阅过{topic}了")
+        return create_reply(ReplyType.TEXT, f"订阅成功，将每天定时推送{topic}")
+
+    def _unsubscribe(self, topic, context):
+        if self.subscriptions is None:
+            return create_reply(ReplyType.TEXT, "未开启订阅推送")
+        if not self.subscriptions.unsubscribe(topic, self._context_subscriber_key(context)):
+            return create_reply(ReplyType.TEXT, f"尚未订阅{topic}")
+        return create_reply(ReplyType.TEXT, f"已取消订阅{topic}")
+
+    def _list_subscriptions(self, context):
+        if self.subscriptions is None:
+            return create_reply(ReplyType.TEXT, "未开启订阅推送")
+        topics = self.subscriptions.topics_of(self._context_subscriber_key(context))
+        if not topics:
+            return create_reply(ReplyType.TEXT, f"尚未订阅任何内容，可订阅：{'、'.join(BROADCAST_TOPICS)}")
+        return create_reply(ReplyType.TEXT, f"已订阅：{'、'.join(topics)}")
+
+    def _fetch_hot_trends(self, hot_trends_type):
+        key = f"热榜:{hot_trends_type}"
+        cached = self._negative_hit(key)
+        if cached is not None:
+            return cached
+        info = get_hot_trends(make_request, handle_error, BASE_URL_VVHAN, hot_trend_types,
+                              whalePlugin, hot_trends_type, limit=self.hot_trends_limit)
+        if not info.startswith("更新时间"):
+            self._remember_failure(key, info)
+        return info
+
+    def _hot_trends(self, hot_trends_type):
+        if hot_trends_type not in hot_trend_types:
+            return create_reply(ReplyType.TEXT, self._fetch_hot_trends(hot_trends_type))
+        hot_trends_info, age = self.hot_trends_cache.get(hot_trends_type)
+        if age is not None and age >= 60:
+            hot_trends_info += f"\n⏱️ 数据获取于 {int(age // 60)} 分钟前"
+        return create_reply(ReplyType.TEXT, hot_trends_info)
+
+    def _breaker_status(self):
+        lines = ["🔌 上游熔断状态："]
+        for host, stats in sorted(http_client.breakers.stats().items()):
+            p99 = f"{stats['p99'] * 1000:.0f}ms" if stats['p99'] is not None else "-"
+            lines.append(
+                f"{host}: {stats['state']} | 错误率 {stats['error_rate']:.0%} | p99 {p99} | 熔断 {stats['trips']} 次")
+        if len(lines) == 1:
+            lines.append("暂无请求记录")
+        return create_reply(ReplyType.TEXT, "\n".join(lines))
 
+    def _stats(self):
+        lines = ["📈 指令统计："]
+        for key, count in sorted(COMMAND_TOTAL.values().items()):
+            labels = dict(key)
+            lines.append(f"{labels['command']}({labels['status']}): {count} 次")
+        for key in sorted(COMMAND_LATENCY.values()):
+            labels = dict(key)
+            p50 = COMMAND_LATENCY.quantile(0.5, **labels)
+            p95 = COMMAND_LATENCY.quantile(0.95, **labels)
+            lines.append(
+                f"{labels['command']} 延迟: p50 {p50 * 1000:.0f}ms | p95 {p95 * 1000:.0f}ms")
+
+        lines.append("\n🌐 上游请求：")
+        outcomes = {}
+        for key, count in UPSTREAM_TOTAL.values().items():
+            labels = dict(key)
+            outcomes.setdefault(labels['host'], {})[labels['outcome']] = count
+        for host, counts in sorted(outcomes.items()):
+            total = sum(counts.values())
+            errors = total - counts.get("ok", 0)
+            p95 = UPSTREAM_LATENCY.quantile(0.95, host=host)
+            p95_text = f"{p95 * 1000:.0f}ms" if p95 is not None else "-"
+            lines.append(
+                f"{host}: {total} 次 | 失败率 {errors / total:.0%} | p95 {p95_text}")
+
+        lines.append("\n🗄️ 缓存命中：")
+        for name, stats in sorted(metrics.cache_stats().items()):
+            lookups = stats.get("hits", 0) + stats.get("misses", 0)
+            ratio = stats.get("hits", 0) / lookups if lookups else 0.0
+            lines.append(
+                f"{name}: 命中率 {ratio:.0%} | 命中 {stats.get('hits', 0)} | 未命中 {stats.get('misses', 0)} | 淘汰 {stats.get('evictions', 0)}")
+
+        if self.admission is not None:
+            stats = self.admission.stats()
+            decisions = stats["decisions"]
+            queue_wait = stats["queue_wait"]
+            queue_wait_text = f"{queue_wait * 1000:.0f}ms" if queue_wait is not None else "-"
+            lines.append("\n🚦 准入控制：")
+            lines.append(
+                f"进行中的上游请求 {stats['in_flight']} | 最久排队 {queue_wait_text} | 降级 {decisions['degrade']} | 拒绝 {decisions['reject']}")
+        return create_reply(ReplyType.TEXT, "\n".join(lines))
+
+    def _weather(self, cities, date, content):
+        if not self.alapi_token:
+            handle_error("alapi_token not configured",
+                         "Weather request failed.")
+            return create_reply(
+                ReplyType.TEXT, "Please configure the 'alapi_token' first.")
+        if len(cities) > 1:
+            return create_reply(ReplyType.TEXT, get_weather_multi(
+                self.alapi_token, cities, date, self.city_index, self.weather_store))
+        city_or_id = cities[0]
+        key = f"天气:{content}"
+        weather_info = self._negative_hit(key)
+        if weather_info is None:
+            weather_info = get_weather(
+                self.alapi_token, city_or_id, date, content, self.city_index, self.weather_store)
+            scope = current_scope()
+            if (scope is not None and scope.failed) or weather_info.startswith("发生错误"):
+                self._remember_failure(key, weather_info)
+        return create_reply(ReplyType.TEXT, weather_info)
+
+
+# 默认每条指令最多 10 秒
+DEFAULT_DEADLINE = 10.0
+
+# 支持订阅推送的内容
+BROADCAST_TOPICS = ("早报", "摸鱼", "每日一题")
+
+# 仅管理员可用的指令
+ADMIN_COMMANDS = {"#whalebreakers", "#whalestats"}
+
+HOROSCOPE_PATTERN = re.compile(r'^([\u4e00-\u9fa5]{2}座)$')
+HOT_TREND_PATTERN = re.compile(r'(.{1,6})热榜$')
+WEATHER_PATTERN = re.compile(
+    r'^(?:(.{2,7}?)(?:市|县|区|镇)?|(\d{7,9}))(:?今天|明天|后天|7天|七天)?(?:的)?天气$')
+# 多城市天气，例如“北京 上海 广州天气”、“101010100，101020100明天天气”
+MULTI_WEATHER_PATTERN = re.compile(r'^(.+?)(今天|明天|后天|7天|七天)?(?:的)?天气$')
+CITY_SEPARATOR = re.compile(r'[\s,，、]+')
+CITY_PATTERN = re.compile(r'^(?:(.{2,7}?)(?:市|县|区|镇)?|(\d{7,9}))$')
+MAX_WEATHER_CITIES = 5
+
+
+# 星座：非十二星座名称的“xx座”提示重新输入
+def _parse_horoscope(content):
+    if HOROSCOPE_PATTERN.match(content):
+        return (content,)
+    return None
+
+
+# 热榜：返回热榜类型
+def _parse_hot_trends(content):
+    hot_trend_match = HOT_TREND_PATTERN.search(content)
+    if hot_trend_match:
+        return (hot_trend_match.group(1).strip(),)
+    return None
+
+
+# 天气：返回 (城市或ID列表, 日期, 原始内容)
+def _parse_weather(content, city_index=None):
+    cities, date = _parse_multi_weather(content, city_index)
+    if cities:
+        return (cities[:MAX_WEATHER_CITIES], date, content)
+    weather_match = WEATHER_PATTERN.match(content)
+    if weather_match:
+        city_or_id = weather_match.group(1) or weather_match.group(2)
+        date = weather_match.group(3) or "今天"
+        return ([city_or_id], date, content)
+    return None
+
+
+# 多城市天气：每一项都必须是城市 ID 或城市索引中已知的城市名，否则按单城市处理，避免把普通聊天拆成多次付费查询
+def _parse_multi_weather(content, city_index):
+    multi_match = MULTI_WEATHER_PATTERN.match(content)
+    if not multi_match:
+        return None, None
+    names = [name for name in CITY_SEPARATOR.split(
+        multi_match.group(1).strip()) if name]
+    if len(names) < 2:
+        return None, None
+    cities = []
+    for name in names:
+        city_match = CITY_PATTERN.match(name)
+        if not city_match:
+            return None, None
+        city = city_match.group(1) or city_match.group(2)
+        if not city.isnumeric() and (city_index is None or city_index.resolve(name) is None):
+            return None, None
+        if city not in cities:
+            cities.append(city)
+    return cities, multi_match.group(2) or "今天"
+
+
+# 链接回复对应的本地文件回复类型
+LOCAL_MEDIA_TYPES = {
+    ReplyType.IMAGE_URL: ReplyType.IMAGE,
+    ReplyType.VIDEO_URL: ReplyType.VIDEO,
+}
 
 ZODIAC_MAPPING = {
     '白羊座': 'aries',